@@ -0,0 +1,116 @@
+# Carga dos agentes em memória
+#
+# Guarda quantas conversas pendentes cada agente tem. É reconstruída no
+# startup com um único GROUP BY e atualizada a cada criação, atribuição e
+# encerramento de conversa. Um heap com invalidação preguiçosa devolve o
+# agente menos ocupado em O(log n), sem consultar o banco.
+#
+# Agentes novos ou removidos (não há rota para isso; são criados direto no
+# banco) aparecem na próxima ressincronização periódica.
+
+import heapq
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlmodel import select
+
+from backend.models import Conversation, User
+
+
+def _as_agent_id(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AgentLoadTracker:
+    def __init__(self):
+        self.agents: Dict[int, dict] = {}
+        self.loads: Dict[int, int] = {}
+        self.heap: List[tuple] = []
+        # Variações de carga feitas enquanto rebuild() espera o banco
+        self._changes: Optional[Dict[int, int]] = None
+
+    async def rebuild(self, session):
+        self._changes = {}
+        try:
+            agents = (await session.exec(select(User).where(User.role == "agent"))).all()
+            counts = (await session.exec(
+                select(Conversation.assigned_to, func.count())
+                .where(Conversation.status == "pending", Conversation.assigned_to.is_not(None))
+                .group_by(Conversation.assigned_to)
+            )).all()
+        finally:
+            changes, self._changes = self._changes, None
+        pending = {}
+        for assigned_to, count in counts:
+            agent_id = _as_agent_id(assigned_to)
+            if agent_id is not None:
+                pending[agent_id] = pending.get(agent_id, 0) + count
+
+        self.agents = {
+            agent.id: {"agent_id": agent.id, "name": agent.name, "email": agent.email}
+            for agent in agents
+        }
+        # Reservas de acquire() durante as consultas não estão na contagem (a
+        # conversa ainda não foi gravada): soma por cima para não perdê-las.
+        # Se a gravação entrou a tempo, sobra uma a mais até a próxima
+        # ressincronização, o que só deixa o agente um pouco menos escolhido.
+        self.loads = {
+            agent_id: max(0, pending.get(agent_id, 0) + changes.get(agent_id, 0))
+            for agent_id in self.agents
+        }
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self.heap = [(load, agent_id) for agent_id, load in self.loads.items()]
+        heapq.heapify(self.heap)
+
+    def _set(self, agent_id: int, load: int):
+        self.loads[agent_id] = load
+        heapq.heappush(self.heap, (load, agent_id))
+        # Compacta quando as entradas obsoletas dominam o heap
+        if len(self.heap) > 4 * len(self.loads) + 16:
+            self._rebuild_heap()
+
+    def _change(self, agent_id: int, delta: int):
+        if self._changes is not None:
+            self._changes[agent_id] = self._changes.get(agent_id, 0) + delta
+        self._set(agent_id, max(0, self.loads[agent_id] + delta))
+
+    def least_busy(self) -> Optional[int]:
+        while self.heap:
+            load, agent_id = self.heap[0]
+            if self.loads.get(agent_id) == load:
+                return agent_id
+            heapq.heappop(self.heap)
+        return None
+
+    def acquire(self) -> Optional[int]:
+        # Escolhe e já reserva o agente, para que webhooks concorrentes
+        # não escolham todos o mesmo
+        agent_id = self.least_busy()
+        if agent_id is not None:
+            self._change(agent_id, 1)
+        return agent_id
+
+    def increment(self, assigned_to, delta: int = 1):
+        agent_id = _as_agent_id(assigned_to)
+        if agent_id in self.loads:
+            self._change(agent_id, delta)
+
+    def release(self, assigned_to):
+        self.increment(assigned_to, -1)
+
+    def move(self, old_assigned_to, new_assigned_to):
+        if _as_agent_id(old_assigned_to) == _as_agent_id(new_assigned_to):
+            return
+        self.release(old_assigned_to)
+        self.increment(new_assigned_to)
+
+    def status(self) -> List[dict]:
+        return [
+            {**info, "pending_conversations": self.loads.get(agent_id, 0)}
+            for agent_id, info in self.agents.items()
+        ]
@@ -0,0 +1,328 @@
+# Arquivamento de conversas encerradas (camada fria)
+#
+# Conversas fechadas sem atividade há mais de min_age saem da tabela
+# message: as mensagens de cada uma viram um registro comprimido (zlib de um
+# array JSON) acrescentado ao segmento atual em ARCHIVE_DIR. Os segmentos
+# só recebem acréscimos; quando passam de segment_max_bytes, começa outro.
+#
+# O índice fica no banco quente, em ArchivedConversation: segmento, posição
+# e tamanho do registro, uma linha pequena por conversa. get_messages lê o
+# registro só quando alguém abre uma conversa arquivada (com um cache LRU
+# dos últimos registros lidos).
+#
+# Ordem das operações: o lote é gravado e sincronizado no disco antes da
+# transação que cria o índice e apaga as mensagens. Uma queda no meio deixa
+# no máximo bytes órfãos no segmento, nunca mensagens perdidas. Cada
+# registro tem um cabeçalho (conversa e tamanho) para inspeção offline.
+#
+# As mensagens arquivadas continuam encontráveis pela busca: antes de
+# apagá-las o arquivador as marca para o índice FTS manter (backend/search.py).
+#
+# Uso offline: python -m backend.archive --older-than-days 30 --vacuum
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+
+from backend.models import ArchivedConversation, Conversation, Message
+from backend.search import keep_archived_in_index, search_index_exists
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+RECORD_MAGIC = b"CARC"
+# magic, conversation_id, tamanho do payload comprimido
+RECORD_HEADER = struct.Struct(">4sQI")
+
+
+def _try_lock(handle) -> bool:
+    """Trava exclusiva do arquivo, sem esperar; False se outro processo já a tem."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def database_size(engine) -> dict:
+    """Tamanho do banco quente: arquivo, WAL e páginas em uso."""
+    if engine.dialect.name != "sqlite":
+        return {}
+    with engine.connect() as conn:
+        page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+        page_count = conn.exec_driver_sql("PRAGMA page_count").scalar()
+        freelist = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    path = engine.url.database
+    wal = f"{path}-wal"
+    return {
+        "file_bytes": os.path.getsize(path) if path and os.path.exists(path) else 0,
+        "wal_bytes": os.path.getsize(wal) if path and os.path.exists(wal) else 0,
+        "used_bytes": (page_count - freelist) * page_size,
+        "free_bytes": freelist * page_size,
+    }
+
+
+class ConversationArchive:
+    def __init__(
+        self,
+        engine,
+        directory: str,
+        min_age: float = 30 * 86400,
+        batch_size: int = 200,
+        segment_max_bytes: int = 64 * 1024 * 1024,
+        cache_size: int = 64,
+    ):
+        self.engine = engine
+        self.directory = directory
+        self.min_age = min_age
+        self.batch_size = batch_size
+        self.segment_max_bytes = segment_max_bytes
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[int, list]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.archived_conversations = 0
+        self.archived_messages = 0
+        self.archived_bytes = 0
+        self.reads = 0
+        self.cache_hits = 0
+        self.last_run: Optional[dict] = None
+
+    # Segmentos
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.seg")
+
+    def _segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".seg")
+        )
+
+    def _current_segment(self) -> int:
+        segments = self._segments()
+        if not segments:
+            return 1
+        last = segments[-1]
+        if os.path.getsize(self._segment_path(last)) >= self.segment_max_bytes:
+            return last + 1
+        return last
+
+    def _append(self, records):
+        """Acrescenta os registros e sincroniza; devolve (segmento, posição, tamanho) de cada um."""
+        locations = []
+        segment = self._current_segment()
+        handle = open(self._segment_path(segment), "ab")
+        try:
+            for conversation_id, payload in records:
+                if handle.tell() >= self.segment_max_bytes:
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                    handle.close()
+                    segment += 1
+                    handle = open(self._segment_path(segment), "ab")
+                offset = handle.tell()
+                handle.write(RECORD_HEADER.pack(RECORD_MAGIC, conversation_id, len(payload)))
+                handle.write(payload)
+                locations.append((segment, offset, RECORD_HEADER.size + len(payload)))
+            handle.flush()
+            os.fsync(handle.fileno())
+        finally:
+            handle.close()
+        return locations
+
+    def read_record(self, entry: ArchivedConversation) -> list:
+        with self._cache_lock:
+            self.reads += 1
+            cached = self.cache.get(entry.conversation_id)
+            if cached is not None:
+                self.cache.move_to_end(entry.conversation_id)
+                self.cache_hits += 1
+                return cached
+
+        with open(self._segment_path(entry.segment), "rb") as f:
+            f.seek(entry.byte_offset)
+            data = f.read(entry.byte_length)
+        magic, conversation_id, size = RECORD_HEADER.unpack_from(data)
+        if magic != RECORD_MAGIC or conversation_id != entry.conversation_id:
+            raise ValueError(f"Registro inválido para a conversa {entry.conversation_id} no segmento {entry.segment}")
+        messages = json.loads(zlib.decompress(data[RECORD_HEADER.size:RECORD_HEADER.size + size]))
+
+        with self._cache_lock:
+            self.cache[entry.conversation_id] = messages
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return messages
+
+    # Leitura pelas rotas
+
+    async def load_messages(self, session, conversation_id: int) -> Optional[list]:
+        """Mensagens arquivadas da conversa (em ordem de id), ou None se ela não foi arquivada."""
+        entry = await session.get(ArchivedConversation, conversation_id)
+        if entry is None:
+            return None
+        return await asyncio.to_thread(self.read_record, entry)
+
+    # Arquivamento
+
+    def _candidates(self, session: Session, cutoff: datetime):
+        last_activity = (
+            select(func.max(Message.timestamp))
+            .where(Message.conversation_id == Conversation.id)
+            .scalar_subquery()
+        )
+        already_archived = select(ArchivedConversation.conversation_id)
+        query = (
+            select(Conversation.id)
+            .where(
+                Conversation.status == "closed",
+                Conversation.id.not_in(already_archived),
+                func.coalesce(last_activity, Conversation.created_at) < cutoff,
+            )
+            .order_by(Conversation.id)
+            .limit(self.batch_size)
+        )
+        return list(session.exec(query).all())
+
+    def archive_batch(self) -> dict:
+        """Arquiva até batch_size conversas; devolve o que foi feito."""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.min_age)
+        with Session(self.engine) as session:
+            searchable = self.engine.dialect.name == "sqlite" and search_index_exists(session)
+            conversation_ids = self._candidates(session, cutoff)
+            records, entries = [], []
+            for conversation_id in conversation_ids:
+                messages = session.exec(
+                    select(Message).where(Message.conversation_id == conversation_id).order_by(Message.id)
+                ).all()
+                body = json.dumps(jsonable_encoder(messages), ensure_ascii=False, separators=(",", ":"))
+                records.append((conversation_id, zlib.compress(body.encode("utf-8"), 9)))
+                entries.append((conversation_id, len(messages), messages[-1].id if messages else 0))
+            if not records:
+                return {"conversations": 0, "messages": 0, "bytes": 0}
+
+            # Primeiro o disco, depois o banco
+            locations = self._append(records)
+            for (conversation_id, count, last_id), (segment, offset, length) in zip(entries, locations):
+                session.add(ArchivedConversation(
+                    conversation_id=conversation_id,
+                    segment=segment,
+                    byte_offset=offset,
+                    byte_length=length,
+                    message_count=count,
+                    last_message_id=last_id,
+                ))
+                if searchable:
+                    keep_archived_in_index(session, conversation_id, last_id)
+                # Mensagens que chegarem depois da leitura continuam no banco quente
+                session.exec(delete(Message).where(Message.conversation_id == conversation_id, Message.id <= last_id))
+            session.commit()
+
+        result = {
+            "conversations": len(entries),
+            "messages": sum(count for _, count, _ in entries),
+            "bytes": sum(length for _, _, length in locations),
+        }
+        self.archived_conversations += result["conversations"]
+        self.archived_messages += result["messages"]
+        self.archived_bytes += result["bytes"]
+        return result
+
+    def run(self, max_batches: Optional[int] = None, vacuum: bool = False) -> dict:
+        """Arquiva em lotes até acabar (ou max_batches) e mede o banco antes e depois."""
+        os.makedirs(self.directory, exist_ok=True)
+        started = datetime.now(timezone.utc)
+        # Um arquivador por vez, mesmo com vários workers
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            if not _try_lock(lock):
+                return {"skipped": "outro processo está arquivando"}
+
+            # Checkpoint antes de medir: no modo WAL o arquivo principal atrasa
+            self._checkpoint()
+            before = database_size(self.engine)
+            total = {"conversations": 0, "messages": 0, "bytes": 0}
+            batches = 0
+            while max_batches is None or batches < max_batches:
+                result = self.archive_batch()
+                batches += 1
+                for key in total:
+                    total[key] += result[key]
+                if result["conversations"] < self.batch_size:
+                    break
+            if vacuum and total["conversations"] and self.engine.dialect.name == "sqlite":
+                # Devolve as páginas livres ao sistema; trava o banco enquanto roda
+                with self.engine.connect() as conn:
+                    conn.exec_driver_sql("VACUUM")
+            self._checkpoint()
+            after = database_size(self.engine)
+
+        self.last_run = {
+            "started_at": started.isoformat(),
+            "duration_s": round((datetime.now(timezone.utc) - started).total_seconds(), 3),
+            "archived": total,
+            "vacuum": vacuum,
+            "hot_db_before": before,
+            "hot_db_after": after,
+        }
+        return self.last_run
+
+    def _checkpoint(self):
+        if self.engine.dialect.name == "sqlite":
+            with self.engine.connect() as conn:
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def stats(self) -> dict:
+        segments = self._segments()
+        return {
+            "directory": self.directory,
+            "min_age_days": round(self.min_age / 86400, 2),
+            "segments": len(segments),
+            "segment_bytes": sum(os.path.getsize(self._segment_path(s)) for s in segments),
+            "archived_conversations": self.archived_conversations,
+            "archived_messages": self.archived_messages,
+            "archived_bytes": self.archived_bytes,
+            "reads": self.reads,
+            "cache_hits": self.cache_hits,
+            "cached": len(self.cache),
+            "last_run": self.last_run,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arquiva conversas encerradas em segmentos comprimidos")
+    parser.add_argument("--directory", default=os.getenv("ARCHIVE_DIR", "./archive"))
+    parser.add_argument("--older-than-days", type=float, default=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")))
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM no fim, para o arquivo do banco encolher")
+    args = parser.parse_args()
+
+    from backend.database import engine
+    from sqlmodel import SQLModel
+
+    SQLModel.metadata.create_all(engine)
+    archive = ConversationArchive(
+        engine, args.directory, min_age=args.older_than_days * 86400, batch_size=args.batch_size
+    )
+    print(json.dumps(archive.run(vacuum=args.vacuum), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# Cache de autenticação
+#
+# Guarda, por token, o usuário já resolvido (JWT decodificado + consulta ao
+# banco). Entradas expiram pelo TTL configurado ou pelo "exp" do próprio
+# token, o que vier antes, e o cache é limitado por LRU. Alterações em User
+# feitas pelo ORM invalidam as entradas daquele email.
+
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+from sqlalchemy import event, inspect
+
+from backend.models import User
+
+
+class AuthCache:
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.tokens_by_email: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[User]:
+        entry = self.entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, user = entry
+        if expires_at <= time.time():
+            self._remove(token)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: User, token_exp: Optional[float] = None):
+        if self.ttl <= 0:
+            return
+        expires_at = time.time() + self.ttl
+        if token_exp is not None:
+            expires_at = min(expires_at, token_exp)
+        # Cópia desanexada da sessão, compartilhada entre requisições
+        cached = User(**user.model_dump())
+        self._remove(token)
+        self.entries[token] = (expires_at, cached)
+        self.tokens_by_email.setdefault(cached.email, set()).add(token)
+        while len(self.entries) > self.max_size:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+
+    def _remove(self, token: str):
+        entry = self.entries.pop(token, None)
+        if entry is None:
+            return
+        email = entry[1].email
+        tokens = self.tokens_by_email.get(email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self.tokens_by_email[email]
+
+    def invalidate_email(self, email: str):
+        for token in list(self.tokens_by_email.get(email, ())):
+            self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.tokens_by_email.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+    def watch_user_changes(self):
+        # Qualquer update/delete de User pelo ORM derruba o cache do email
+        # (antigo e novo, caso o email tenha mudado)
+        def invalidate(mapper, connection, target):
+            history = inspect(target).attrs.email.history
+            for email in {target.email, *(history.deleted or ())}:
+                if email:
+                    self.invalidate_email(email)
+
+        event.listen(User, "after_update", invalidate)
+        event.listen(User, "after_delete", invalidate)
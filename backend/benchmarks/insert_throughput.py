@@ -0,0 +1,75 @@
+# Inserções de Message por segundo: um commit por mensagem x group commit
+#
+# Uso: python -m backend.benchmarks.insert_throughput --messages 5000 --producers 50 --synchronous FULL
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.database import SQLITE_PRAGMAS, _apply_sqlite_pragmas
+from backend.models import Message
+from backend.write_batcher import GroupCommitWriter
+
+
+async def produce(messages: int, producers: int, insert):
+    async def producer(index: int):
+        for i in range(index, messages, producers):
+            await insert(Message(conversation_id=i % 100 + 1, sender="customer", content=f"mensagem {i}"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer(p) for p in range(producers)))
+    return time.perf_counter() - start
+
+
+async def run(path: str, messages: int, producers: int, max_delay_ms: float, max_batch: int):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=producers, max_overflow=0)
+    _apply_sqlite_pragmas(engine.sync_engine)
+    session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+    async def insert_and_commit(message):
+        async with session_maker() as session:
+            session.add(message)
+            await session.commit()
+
+    results = {"commit por mensagem": await produce(messages, producers, insert_and_commit)}
+
+    writer = GroupCommitWriter(session_maker, max_batch=max_batch, max_delay=max_delay_ms / 1000)
+    writer.start()
+    results["group commit"] = await produce(messages, producers, writer.add)
+    await writer.stop()
+    await engine.dispose()
+    return results, writer.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--producers", type=int, default=50)
+    parser.add_argument("--delay-ms", type=float, default=2.0)
+    parser.add_argument("--max-batch", type=int, default=500)
+    parser.add_argument("--synchronous", default=SQLITE_PRAGMAS["synchronous"], help="NORMAL ou FULL (fsync a cada commit)")
+    args = parser.parse_args()
+
+    SQLITE_PRAGMAS["synchronous"] = args.synchronous
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    SQLModel.metadata.create_all(create_engine(f"sqlite:///{path}"))
+
+    results, stats = asyncio.run(run(path, args.messages, args.producers, args.delay_ms, args.max_batch))
+
+    print(f"{args.messages} mensagens, {args.producers} produtores, synchronous={args.synchronous}")
+    for name, elapsed in results.items():
+        print(f"{name:22} {elapsed:8.2f} s {args.messages / elapsed:10.0f} inserções/s")
+    print(f"lotes: {stats['batches']}, tamanho médio {stats['avg_batch_size']}, máximo {stats['max_batch_size']}")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
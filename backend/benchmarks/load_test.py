@@ -0,0 +1,344 @@
+# Teste de carga ponta a ponta: clientes WhatsApp simulados + agentes no WebSocket
+#
+# Sobe os stubs de Rasa/Ollama e o backend (transporte WhatsApp fake, banco
+# temporário com agentes de teste), abre M WebSockets de agentes (mais um
+# admin, que recebe as respostas dos bots) e dispara N clientes simulados no
+# /webhook/whatsapp, alternando JSON e form do Twilio. Cada cliente envia
+# uma mensagem por vez e espera ela chegar a algum WebSocket; a latência
+# medida vai do POST do webhook até a entrega.
+#
+# Os resultados ficam em JSON (--output) e podem ser comparados com uma
+# execução anterior (--compare); o processo sai com código 1 se houver
+# regressão acima da tolerância.
+#
+# Uso: python -m backend.benchmarks.load_test --customers 200 --messages 5 --agents 20
+#      python -m backend.benchmarks.load_test --compare backend/benchmarks/results/<anterior>.json
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import httpx
+import websockets
+from passlib.context import CryptContext
+from sqlmodel import Session, SQLModel, create_engine
+
+from backend.models import User
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+RESULTS_DIR = os.path.join(ROOT, "backend", "benchmarks", "results")
+AGENT_PASSWORD = "loadtest"
+ADMIN_EMAIL, ADMIN_PASSWORD = "admin@test.com", "senha123"
+
+# Métricas comparadas com --compare: (caminho, maior é melhor)
+COMPARED_METRICS = [
+    ("throughput.delivered_per_second", True),
+    ("e2e_ms.p50", False),
+    ("e2e_ms.p95", False),
+    ("e2e_ms.p99", False),
+    ("webhook_ack_ms.p95", False),
+    ("timeouts", False),
+    ("errors", False),
+]
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+
+    def at(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))], 2)
+
+    return {"count": len(values), "p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": round(values[-1], 2)}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed_agents(database_url: str, agents: int):
+    engine = create_engine(database_url)
+    SQLModel.metadata.create_all(engine)
+    # bcrypt é lento: um hash só, compartilhado por todos os agentes de teste
+    password_hash = CryptContext(schemes=["bcrypt"]).hash(AGENT_PASSWORD)
+    with Session(engine) as session:
+        for i in range(agents):
+            session.add(User(email=f"loadtest{i}@test.com", name=f"Agente {i}", password_hash=password_hash, role="agent"))
+        session.commit()
+    engine.dispose()
+
+
+async def wait_until_up(url: str, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url, timeout=1.0)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} não respondeu em {timeout:.0f} s")
+
+
+def start_processes(args, workdir: str):
+    stub_port, app_port = free_port(), free_port()
+    stub_log = open(os.path.join(workdir, "stubs.log"), "w")
+    stubs = subprocess.Popen(
+        [
+            sys.executable, "-m", "backend.benchmarks.stubs", "--port", str(stub_port),
+            "--rasa-latency-ms", str(args.rasa_latency_ms), "--rasa-answer-rate", str(args.rasa_answer_rate),
+            "--ollama-latency-ms", str(args.ollama_latency_ms), "--ollama-answer-rate", str(args.ollama_answer_rate),
+        ],
+        cwd=ROOT, stdout=stub_log, stderr=subprocess.STDOUT,
+    )
+
+    database_url = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    seed_agents(database_url, args.agents)
+    env = dict(
+        os.environ,
+        DATABASE_URL=database_url,
+        WHATSAPP_TRANSPORT="fake",
+        WHATSAPP_FAKE_LATENCY_MS=str(args.twilio_latency_ms),
+        RASA_URL=f"http://127.0.0.1:{stub_port}",
+        OLLAMA_URL=f"http://127.0.0.1:{stub_port}",
+        OLLAMA_STREAM="1" if args.ollama_stream else "0",
+        BOT_CACHE_TTL="0",  # o cache esconderia a latência dos bots
+        WS_BATCH_MS=str(args.ws_batch_ms),
+    )
+    app_log = open(os.path.join(workdir, "app.log"), "w")
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(app_port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=app_log, stderr=subprocess.STDOUT,
+    )
+    return [stubs, app], f"http://127.0.0.1:{stub_port}", f"http://127.0.0.1:{app_port}"
+
+
+class LoadTest:
+    def __init__(self, args, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.run_id = uuid.uuid4().hex[:8]
+        # número do cliente -> (texto esperado, future com o instante da entrega)
+        self.pending = {}
+        self.ack_ms = []
+        self.e2e_ms = []
+        self.routes = {"agent": 0, "bot": 0}
+        self.timeouts = 0
+        self.errors = 0
+
+    async def login(self, client: httpx.AsyncClient, email: str, password: str) -> str:
+        response = await client.post("/login", data={"username": email, "password": password})
+        response.raise_for_status()
+        return response.json()["access_token"]
+
+    async def listen(self, token: str, ready: asyncio.Event):
+        url = self.base_url.replace("http", "ws", 1) + f"/ws?token={token}"
+        async with websockets.connect(url, max_size=None) as ws:
+            ready.set()
+            async for raw in ws:
+                received_at = time.perf_counter()
+                payload = json.loads(raw)
+                # Com WS_BATCH_MS o servidor manda vários eventos num array
+                for data in payload if isinstance(payload, list) else [payload]:
+                    if data.get("type") == "ping":
+                        await ws.send(json.dumps({"type": "pong", "ts": data.get("ts")}))
+                        continue
+                    self.on_event(data, received_at)
+
+    def on_event(self, data: dict, received_at: float):
+        entry = self.pending.get(data.get("customer_number"))
+        if entry is None or entry[1].done():
+            return
+        body, future = entry
+        if data.get("sender") == "customer" and data.get("message") == body:
+            future.set_result(("agent", received_at))
+        elif data.get("sender") == "bot" and data.get("type") != "bot_partial":
+            future.set_result(("bot", received_at))
+
+    async def customer(self, client: httpx.AsyncClient, index: int):
+        number = f"+5599{self.run_id[:4]}{index:06d}"
+        use_form = self.args.format == "form" or (self.args.format == "mixed" and index % 2)
+        for k in range(self.args.messages):
+            body = f"loadtest {self.run_id} cliente {index} mensagem {k}"
+            future = asyncio.get_running_loop().create_future()
+            self.pending[number] = (body, future)
+            start = time.perf_counter()
+            try:
+                if use_form:
+                    response = await client.post("/webhook/whatsapp", data={
+                        "From": f"whatsapp:{number}",
+                        "Body": body,
+                        "ProfileName": f"Cliente {index}",
+                        "MessageSid": f"SMlt{self.run_id}{index:06d}{k:04d}",
+                    })
+                else:
+                    response = await client.post("/webhook/whatsapp", json={
+                        "from": f"whatsapp:{number}", "message": body, "name": f"Cliente {index}",
+                    })
+                self.ack_ms.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200 or response.json().get("status") == "erro":
+                    self.errors += 1
+                    continue
+                route, delivered_at = await asyncio.wait_for(future, self.args.timeout)
+                self.e2e_ms.append((delivered_at - start) * 1000)
+                self.routes[route] += 1
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+            except httpx.HTTPError:
+                self.errors += 1
+            finally:
+                self.pending.pop(number, None)
+            if self.args.think_ms:
+                await asyncio.sleep(random.uniform(0, 2 * self.args.think_ms) / 1000)
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=self.args.concurrency or self.args.customers)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=30.0, limits=limits) as client:
+            tokens = [await self.login(client, ADMIN_EMAIL, ADMIN_PASSWORD)]
+            tokens += await asyncio.gather(*(
+                self.login(client, f"loadtest{i}@test.com", AGENT_PASSWORD) for i in range(self.args.agents)
+            ))
+            ready = [asyncio.Event() for _ in tokens]
+            listeners = [asyncio.create_task(self.listen(t, e)) for t, e in zip(tokens, ready)]
+            await asyncio.wait_for(asyncio.gather(*(e.wait() for e in ready)), 30)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(self.customer(client, i) for i in range(self.args.customers)))
+            elapsed = time.perf_counter() - start
+
+            admin = {"Authorization": f"Bearer {tokens[0]}"}
+            server = {}
+            for name in ("inbox", "writes", "bots", "websockets"):
+                response = await client.get(f"/admin/{name}", headers=admin)
+                if response.status_code == 200:
+                    server[name] = response.json()
+
+            for task in listeners:
+                task.cancel()
+            await asyncio.gather(*listeners, return_exceptions=True)
+
+        sent = self.args.customers * self.args.messages
+        return {
+            "run_id": self.run_id,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "config": {k: v for k, v in vars(self.args).items() if k not in ("compare", "output")},
+            "duration_s": round(elapsed, 3),
+            "sent": sent,
+            "delivered": len(self.e2e_ms),
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "routes": self.routes,
+            "throughput": {
+                "webhooks_per_second": round(len(self.ack_ms) / elapsed, 2),
+                "delivered_per_second": round(len(self.e2e_ms) / elapsed, 2),
+            },
+            "webhook_ack_ms": percentiles(self.ack_ms),
+            "e2e_ms": percentiles(self.e2e_ms),
+            "server": server,
+        }
+
+
+def metric(result: dict, path: str):
+    value = result
+    for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current: dict, previous: dict, tolerance: float) -> bool:
+    print(f"\n{'métrica':34} {'anterior':>12} {'atual':>12} {'variação':>10}")
+    regressed = False
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = metric(previous, path), metric(current, path)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > tolerance and abs(new - old) > 0:
+            flag = "  REGRESSÃO"
+            regressed = True
+        print(f"{path:34} {old:12.2f} {new:12.2f} {change * 100:9.1f}%{flag}")
+    return regressed
+
+
+def print_summary(result: dict):
+    e2e, ack = result["e2e_ms"], result["webhook_ack_ms"]
+    print(f"\n{result['sent']} mensagens de {result['config']['customers']} clientes em {result['duration_s']:.1f} s")
+    print(f"entregues: {result['delivered']} (agente {result['routes']['agent']}, bot {result['routes']['bot']}), "
+          f"timeouts: {result['timeouts']}, erros: {result['errors']}")
+    print(f"vazão: {result['throughput']['webhooks_per_second']} webhooks/s, "
+          f"{result['throughput']['delivered_per_second']} entregas/s")
+    print(f"ack do webhook (ms): p50 {ack['p50']}  p95 {ack['p95']}  p99 {ack['p99']}")
+    print(f"webhook -> WebSocket (ms): p50 {e2e['p50']}  p95 {e2e['p95']}  p99 {e2e['p99']}  max {e2e['max']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5, help="mensagens por cliente")
+    parser.add_argument("--agents", type=int, default=10, help="WebSockets de agentes")
+    parser.add_argument("--format", choices=("json", "form", "mixed"), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=0, help="conexões HTTP (0 = uma por cliente)")
+    parser.add_argument("--think-ms", type=float, default=50, help="pausa média entre mensagens do cliente")
+    parser.add_argument("--timeout", type=float, default=15, help="espera máxima pela entrega (s)")
+    parser.add_argument("--twilio-latency-ms", type=float, default=50)
+    parser.add_argument("--rasa-latency-ms", type=float, default=30)
+    parser.add_argument("--rasa-answer-rate", type=float, default=0.3)
+    parser.add_argument("--ollama-latency-ms", type=float, default=400)
+    parser.add_argument("--ollama-answer-rate", type=float, default=0.0)
+    parser.add_argument("--ollama-stream", action="store_true")
+    parser.add_argument("--ws-batch-ms", type=float, default=0, help="WS_BATCH_MS do backend")
+    parser.add_argument("--target", help="URL de um backend já rodando (sem stubs nem banco temporário)")
+    parser.add_argument("--output", help="arquivo JSON do resultado (padrão: backend/benchmarks/results/)")
+    parser.add_argument("--compare", help="resultado anterior para comparar")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="piora relativa aceita no --compare")
+    args = parser.parse_args()
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            processes, stub_url, base_url = start_processes(args, workdir)
+            asyncio.run(wait_until_up(stub_url + "/stats"))
+        asyncio.run(wait_until_up(base_url + "/"))
+        result = asyncio.run(LoadTest(args, base_url).run())
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    print_summary(result)
+    output = args.output or os.path.join(RESULTS_DIR, f"load_test-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"\nresultado salvo em {output} (logs em {workdir})")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        if compare(result, previous, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
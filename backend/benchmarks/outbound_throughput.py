@@ -0,0 +1,54 @@
+# Benchmark offline do pipeline de envio (transporte fake, sem Twilio)
+#
+# Uso: python -m backend.benchmarks.outbound_throughput --messages 2000 --workers 8 --latency-ms 50
+
+import argparse
+import asyncio
+import time
+
+from backend.outbound import OutboundDispatcher, FakeTransport
+
+
+async def run(messages: int, workers: int, latency_ms: float, rate: float, failure_rate: float):
+    transport = FakeTransport(latency=latency_ms / 1000, failure_rate=failure_rate)
+    dispatcher = OutboundDispatcher(
+        transport,
+        workers=workers,
+        rate_per_sender=rate,
+        backoff_base=0.01,
+        queue_size=messages,
+    )
+    await dispatcher.start()
+
+    start = time.perf_counter()
+    for i in range(messages):
+        await dispatcher.enqueue(f"+5511{i:09d}", f"mensagem {i}")
+    enqueued = time.perf_counter() - start
+
+    while dispatcher.sent_count + dispatcher.failed_count < messages:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    await dispatcher.stop()
+
+    stats = dispatcher.stats()
+    print(f"mensagens:        {messages}")
+    print(f"workers:          {workers}")
+    print(f"enfileiramento:   {enqueued * 1000:.1f} ms ({messages / enqueued:.0f} msg/s)")
+    print(f"tempo total:      {elapsed:.2f} s")
+    print(f"vazão de entrega: {messages / elapsed:.0f} msg/s")
+    print(f"enviadas={stats['sent']} falhas={stats['failed']} retentativas={stats['retries']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--rate", type=float, default=0, help="limite por worker (msg/s), 0 = sem limite")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.workers, args.latency_ms, args.rate, args.failure_rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Latência das consultas mais usadas, antes e depois das migrações de índice
+#
+# Uso: python -m backend.benchmarks.query_latency --messages 1000000 --conversations 50000
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from sqlmodel import SQLModel, create_engine
+
+from backend import models  # noqa: F401 - registra as tabelas no metadata
+from backend.migrations import run_migrations
+
+
+def populate(path: str, messages: int, conversations: int, agents: int):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.executemany(
+        "INSERT INTO user (email, name, password_hash, role) VALUES (?, ?, ?, ?)",
+        [(f"agent{i}@test.com", f"Agent {i}", "x", "agent") for i in range(agents)],
+    )
+    now = "2026-01-01 00:00:00"
+    conn.executemany(
+        "INSERT INTO conversation (customer_number, name, assigned_to, created_by, created_at, status) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (f"+55{i:011d}", f"Cliente {i}", str(i % agents + 1), str(i % agents + 1), now,
+             "pending" if i % 10 == 0 else "closed")
+            for i in range(conversations)
+        ),
+    )
+    conn.executemany(
+        "INSERT INTO message (conversation_id, sender, content, timestamp) VALUES (?, ?, ?, ?)",
+        (
+            (random.randint(1, conversations), "customer", f"mensagem {i}", now)
+            for i in range(messages)
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def measure(path: str, conversations: int, agents: int, repeat: int):
+    conn = sqlite3.connect(path)
+    queries = {
+        "get_messages": (
+            "SELECT * FROM message WHERE conversation_id = ?",
+            lambda: (random.randint(1, conversations),),
+        ),
+        "conversa pendente do cliente": (
+            "SELECT * FROM conversation WHERE customer_number = ? AND status = 'pending' LIMIT 1",
+            lambda: (f"+55{random.randrange(conversations):011d}",),
+        ),
+        "carga do agente": (
+            "SELECT count(*) FROM conversation WHERE assigned_to = ? AND status = 'pending'",
+            lambda: (str(random.randint(1, agents)),),
+        ),
+        "usuário por email": (
+            "SELECT * FROM user WHERE email = ?",
+            lambda: (f"agent{random.randrange(agents)}@test.com",),
+        ),
+    }
+    results = {}
+    for name, (sql, params) in queries.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params()).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[int(len(timings) * 0.95) - 1])
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--conversations", type=int, default=50_000)
+    parser.add_argument("--agents", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+
+    start = time.perf_counter()
+    populate(path, args.messages, args.conversations, args.agents)
+    print(f"{args.messages} mensagens em {args.conversations} conversas geradas em {time.perf_counter() - start:.1f} s")
+
+    before = measure(path, args.conversations, args.agents, args.repeat)
+    start = time.perf_counter()
+    run_migrations(engine)
+    print(f"migrações aplicadas em {time.perf_counter() - start:.1f} s")
+    after = measure(path, args.conversations, args.agents, args.repeat)
+
+    print(f"{'consulta':32} {'antes p50/p95 (ms)':>22} {'depois p50/p95 (ms)':>22}")
+    for name in before:
+        b50, b95 = before[name]
+        a50, a95 = after[name]
+        print(f"{name:32} {b50:10.3f} / {b95:9.3f} {a50:10.3f} / {a95:9.3f}")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# Stubs locais de Rasa e Ollama para testes de carga
+#
+# Respondem nas mesmas rotas dos serviços reais, com latência configurável e
+# uma fração de mensagens respondidas (o resto recusa / pede atendente, e a
+# mensagem segue para um agente). O Twilio não precisa de stub: o backend
+# tem WHATSAPP_TRANSPORT=fake.
+#
+# Uso: python -m backend.benchmarks.stubs --port 5055 --rasa-latency-ms 30 --ollama-latency-ms 400
+
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from backend.bot_pipeline import OLLAMA_HANDOFF
+
+
+def create_stub_app(
+    rasa_latency: float = 0.03,
+    rasa_answer_rate: float = 0.3,
+    ollama_latency: float = 0.4,
+    ollama_answer_rate: float = 0.0,
+    ollama_tokens: int = 20,
+) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = {"rasa": 0, "ollama": 0}
+
+    @app.post("/webhooks/rest/webhook")
+    async def rasa(payload: dict):
+        app.state.requests["rasa"] += 1
+        await asyncio.sleep(rasa_latency)
+        if random.random() < rasa_answer_rate:
+            return [{"recipient_id": payload.get("sender"), "text": "Resposta automática do Rasa"}]
+        return []
+
+    @app.post("/api/generate")
+    async def ollama(request: Request):
+        payload = await request.json()
+        app.state.requests["ollama"] += 1
+        if random.random() < ollama_answer_rate:
+            words = ["Resposta ", "gerada ", "pelo ", "modelo "] * (ollama_tokens // 4 or 1)
+        else:
+            words = ["Vou ", "chamar ", "alguém: ", f"{OLLAMA_HANDOFF}."]
+        if not payload.get("stream", True):
+            await asyncio.sleep(ollama_latency)
+            return {"model": payload.get("model"), "response": "".join(words), "done": True}
+
+        async def tokens():
+            for word in words:
+                await asyncio.sleep(ollama_latency / len(words))
+                yield json.dumps({"response": word, "done": False}) + "\n"
+            yield json.dumps({"response": "", "done": True}) + "\n"
+
+        return StreamingResponse(tokens(), media_type="application/x-ndjson")
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--rasa-latency-ms", type=float, default=30)
+    parser.add_argument("--rasa-answer-rate", type=float, default=0.3)
+    parser.add_argument("--ollama-latency-ms", type=float, default=400)
+    parser.add_argument("--ollama-answer-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app = create_stub_app(
+        rasa_latency=args.rasa_latency_ms / 1000,
+        rasa_answer_rate=args.rasa_answer_rate,
+        ollama_latency=args.ollama_latency_ms / 1000,
+        ollama_answer_rate=args.ollama_answer_rate,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
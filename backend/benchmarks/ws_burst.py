@@ -0,0 +1,192 @@
+# Rajada de eventos nos WebSockets: frames por segundo e bytes na rede
+#
+# Sobe um app mínimo com o ConnectionManager (sem banco), conecta C
+# clientes através de um proxy TCP que conta os bytes enviados pelo
+# servidor e dispara N eventos parecidos com os reais. Compara um frame por
+# evento com o agrupamento (WS_BATCH_MS), com e sem permessage-deflate.
+#
+# Uso: python -m backend.benchmarks.ws_burst --clients 20 --events 2000 --batch-ms 0 15
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+import websockets
+from fastapi import FastAPI, WebSocket
+
+from backend.benchmarks.load_test import ROOT, free_port, wait_until_up
+from backend.connections import ConnectionManager
+
+
+def create_burst_app(batch_ms: float) -> FastAPI:
+    app = FastAPI()
+    manager = ConnectionManager(max_queue=100_000, ping_interval=0, batch_window=batch_ms / 1000)
+
+    @app.on_event("startup")
+    async def start():
+        await manager.start()
+
+    @app.on_event("shutdown")
+    async def stop():
+        await manager.stop()
+
+    @app.get("/")
+    async def root():
+        return manager.stats()
+
+    @app.post("/burst")
+    async def burst(events: int):
+        for i in range(events):
+            await manager.broadcast({
+                "id": i,
+                "conversation_id": i % 50 + 1,
+                "sender": "customer",
+                "message": f"Olá, gostaria de saber o status do pedido {100000 + i}",
+                "timestamp": datetime.now(timezone.utc),
+                "customer_name": "Cliente",
+                "customer_number": f"+55119{i % 50:08d}",
+            })
+        return {"published": events}
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket, user_id: int):
+        await manager.connect(websocket, user_id, "agent")
+        await manager.receive_loop(websocket)
+
+    return app
+
+
+class CountingProxy:
+    """Proxy TCP que conta os bytes do servidor para os clientes."""
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.downstream = 0
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _handle(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", self.target_port)
+
+        async def pipe(reader, writer, count: bool):
+            try:
+                while data := await reader.read(65536):
+                    if count:
+                        self.downstream += len(data)
+                    writer.write(data)
+                    await writer.drain()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+            finally:
+                writer.close()
+
+        await asyncio.gather(pipe(client_reader, server_writer, False), pipe(server_reader, client_writer, True))
+
+    async def stop(self):
+        self.server.close()
+
+
+async def run_scenario(port: int, clients: int, events: int, compression):
+    proxy = CountingProxy(port)
+    proxy_port = await proxy.start()
+    frames = [0] * clients
+    received = [0] * clients
+    done = asyncio.Event()
+    finished = 0
+
+    async def client(index: int, ready: asyncio.Event):
+        nonlocal finished
+        url = f"ws://127.0.0.1:{proxy_port}/ws?user_id={index}"
+        async with websockets.connect(url, compression=compression, max_size=None) as ws:
+            await ws.recv()  # hello
+            ready.set()
+            async for raw in ws:
+                payload = json.loads(raw)
+                frames[index] += 1
+                received[index] += len(payload) if isinstance(payload, list) else 1
+                if received[index] >= events:
+                    finished += 1
+                    if finished == clients:
+                        done.set()
+                    return
+
+    ready = [asyncio.Event() for _ in range(clients)]
+    tasks = [asyncio.create_task(client(i, ready[i])) for i in range(clients)]
+    await asyncio.gather(*(e.wait() for e in ready))
+    proxy.downstream = 0
+
+    start = time.perf_counter()
+    async with httpx.AsyncClient(timeout=120) as http:
+        await http.post(f"http://127.0.0.1:{port}/burst", params={"events": events})
+    await asyncio.wait_for(done.wait(), 120)
+    elapsed = time.perf_counter() - start
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await proxy.stop()
+    total_events = sum(received)
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "events_per_second": round(total_events / elapsed),
+        "frames": sum(frames),
+        "frames_per_second": round(sum(frames) / elapsed),
+        "events_per_frame": round(total_events / max(sum(frames), 1), 1),
+        "wire_bytes": proxy.downstream,
+        "bytes_per_event": round(proxy.downstream / max(total_events, 1), 1),
+    }
+
+
+def start_server(batch_ms: float):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "backend.benchmarks.ws_burst", "--serve", "--port", str(port), "--batch-ms", str(batch_ms)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT,
+    )
+    return process, port
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--events", type=int, default=2000, help="eventos por rajada (cada cliente recebe todos)")
+    parser.add_argument("--batch-ms", type=float, nargs="+", default=[0, 15], help="janelas comparadas (0 = sem agrupar)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        import uvicorn
+
+        batch_ms = args.batch_ms[0]
+        uvicorn.run(create_burst_app(batch_ms), host="127.0.0.1", port=args.port, log_level="warning")
+        return
+
+    print(f"{args.clients} clientes, {args.events} eventos por rajada")
+    print(f"{'janela':>8} {'deflate':>8} {'tempo s':>8} {'eventos/s':>10} {'frames/s':>9} {'ev/frame':>9} {'bytes':>11} {'B/evento':>9}")
+    for batch_ms in args.batch_ms:
+        process, port = start_server(batch_ms)
+        try:
+            asyncio.run(wait_until_up(f"http://127.0.0.1:{port}/"))
+            for compression in (None, "deflate"):
+                r = asyncio.run(run_scenario(port, args.clients, args.events, compression))
+                print(
+                    f"{batch_ms:>6.0f}ms {'sim' if compression else 'não':>8} {r['elapsed_s']:>8.2f} "
+                    f"{r['events_per_second']:>10} {r['frames_per_second']:>9} {r['events_per_frame']:>9} "
+                    f"{r['wire_bytes']:>11} {r['bytes_per_event']:>9}"
+                )
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
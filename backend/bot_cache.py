@@ -0,0 +1,115 @@
+# Cache de respostas dos bots
+#
+# Boa parte do tráfego são saudações e perguntas repetidas, então as
+# respostas do Rasa e do Ollama são guardadas pela mensagem normalizada
+# (sem caixa, acentos, pontuação e espaços extras). LRU com TTL e tamanho
+# máximo; opcionalmente salvo em disco para sobreviver a reinícios.
+
+import json
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    kept = []
+    for char in decomposed:
+        category = unicodedata.category(char)
+        if category == "Mn":  # acentos
+            continue
+        kept.append(" " if category[0] in ("P", "S") else char)
+    return _WHITESPACE.sub(" ", "".join(kept)).strip()
+
+
+class BotResponseCache:
+    def __init__(self, max_size: int = 2048, ttl: float = 3600.0, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        # (kind, texto normalizado) -> (expira_em, valor, custo em segundos)
+        self.entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, kind: str, text: str) -> Tuple[bool, Any]:
+        key = (kind, normalize_text(text))
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[2]
+        return True, entry[1]
+
+    def put(self, kind: str, text: str, value: Any, cost: float = 0.0):
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        key = (kind, normalize_text(text))
+        if not key[1]:
+            return
+        self.entries[key] = (time.time() + self.ttl, value, cost)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            print("Erro ao carregar cache dos bots:", e)
+            return
+        now = time.time()
+        for kind, text, expires_at, value, cost in rows:
+            if expires_at > now:
+                self.entries[(kind, text)] = (expires_at, value, cost)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def snapshot(self) -> list:
+        """Linhas para gravar; chamar no event loop, que é quem altera entries."""
+        now = time.time()
+        return [
+            [kind, text, expires_at, value, cost]
+            for (kind, text), (expires_at, value, cost) in list(self.entries.items())
+            if expires_at > now
+        ]
+
+    def save(self, rows: Optional[list] = None):
+        """Grava o snapshot (ou um novo) no arquivo; pode rodar fora do event loop."""
+        if not self.path:
+            return
+        if rows is None:
+            rows = self.snapshot()
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(rows, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print("Erro ao salvar cache dos bots:", e)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "saved_generation_seconds": round(self.saved_seconds, 3),
+            "persistent": bool(self.path),
+        }
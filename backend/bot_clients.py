@@ -0,0 +1,160 @@
+# Clientes HTTP dos bots (Rasa e Ollama)
+#
+# Um httpx.AsyncClient por backend, criado no startup e reaproveitado entre
+# mensagens (pool de conexões keep-alive), com timeouts próprios e um
+# circuit breaker: depois de falhas seguidas o backend é pulado por um
+# tempo e a mensagem segue direto para atendimento humano.
+
+import asyncio
+import json
+import statistics
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"  # closed | open | half_open
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            # Deixa uma requisição de teste passar
+            self.state = "half_open"
+            return True
+        if self.state == "half_open":
+            # Já existe uma requisição de teste em andamento
+            return False
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class BotClient:
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeout: float,
+        connect_timeout: float = 1.0,
+        max_connections: int = 20,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.breaker = breaker or CircuitBreaker()
+        self.client: Optional[httpx.AsyncClient] = None
+        self.latencies = deque(maxlen=512)
+        self.successes = 0
+        self.failures = 0
+        self.short_circuits = 0
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+
+    async def stop(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def post_json(self, path: str, payload: dict):
+        if not self.breaker.allow():
+            self.short_circuits += 1
+            return None
+        await self.start()
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(path, json=payload)
+            response.raise_for_status()
+            data = response.json()
+        except asyncio.CancelledError:
+            # Cancelada por quem chamou (ex.: corrida entre bots): não conta
+            # como falha, mas libera o teste do half_open
+            if self.breaker.state == "half_open":
+                self.breaker.state = "open"
+            raise
+        except Exception as e:
+            self._record(start, ok=False)
+            print(f"Erro ao consultar {self.name}: {type(e).__name__} {e}")
+            return None
+        self._record(start, ok=True)
+        return data
+
+    async def stream_json_lines(self, path: str, payload: dict):
+        # Resposta em NDJSON (uma linha JSON por pedaço). Se quem consome
+        # parar de iterar, a conexão é fechada e o backend interrompe a geração.
+        if not self.breaker.allow():
+            self.short_circuits += 1
+            return
+        await self.start()
+        start = time.perf_counter()
+        try:
+            async with self.client.stream("POST", path, json=payload) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        yield json.loads(line)
+        except GeneratorExit:
+            # Interrompida por quem consome (ex.: pedido de atendente): o
+            # backend respondeu normalmente
+            self._record(start, ok=True)
+            raise
+        except asyncio.CancelledError:
+            if self.breaker.state == "half_open":
+                self.breaker.state = "open"
+            raise
+        except Exception as e:
+            self._record(start, ok=False)
+            print(f"Erro ao consultar {self.name}: {type(e).__name__} {e}")
+            return
+        self._record(start, ok=True)
+
+    def _record(self, start: float, ok: bool):
+        self.latencies.append(time.perf_counter() - start)
+        if ok:
+            self.successes += 1
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.breaker.record_failure()
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "breaker_state": self.breaker.state,
+            "breaker_opened": self.breaker.times_opened,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "short_circuits": self.short_circuits,
+            "latency_ms": {
+                "count": len(latencies),
+                "p50": round(statistics.median(latencies) * 1000, 2) if latencies else None,
+                "p95": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2) if len(latencies) >= 20 else None,
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            },
+        }
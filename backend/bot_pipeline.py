@@ -0,0 +1,136 @@
+# Orquestração dos bots com orçamento de latência
+#
+# Rasa e Ollama são chamados em paralelo (o Ollama de forma especulativa).
+# Se o Rasa responde com uma intenção, a geração do Ollama é cancelada; se
+# o Rasa recusa, usamos o Ollama; se o orçamento total acaba antes de uma
+# resposta útil, a mensagem vai para atendimento humano. O tempo de cada
+# etapa fica registrado em cada decisão e agregado em stats().
+
+import asyncio
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+RASA_HANDOFF = "encaminhar_para_humano"
+OLLAMA_HANDOFF = "falar com atendente"
+
+
+@dataclass
+class BotDecision:
+    source: Optional[str] = None  # "rasa" | "ollama" | None (humano)
+    text: Optional[str] = None
+    reason: str = "no_answer"  # rasa | ollama | handoff | budget_exceeded | no_answer
+    timings: dict = field(default_factory=dict)
+
+
+def first_rasa_text(responses) -> Optional[str]:
+    for response in responses or []:
+        text = response.get("text")
+        if text and RASA_HANDOFF not in text.lower():
+            return text
+    return None
+
+
+class BotPipeline:
+    def __init__(
+        self,
+        query_rasa: Callable[[str, str], Awaitable],
+        query_ollama: Callable[[str, str], Awaitable],
+        budget: float = 8.0,
+        speculative: bool = True,
+        history_size: int = 1000,
+    ):
+        self.query_rasa = query_rasa
+        self.query_ollama = query_ollama
+        self.budget = budget
+        self.speculative = speculative
+        self.history = deque(maxlen=history_size)
+        self.outcomes = Counter()
+
+    async def _timed(self, name: str, coro, timings: dict, start: float):
+        try:
+            return await coro
+        finally:
+            timings[f"{name}_ms"] = round((time.perf_counter() - start) * 1000, 2)
+
+    @staticmethod
+    async def _cancel(task: Optional[asyncio.Task], timings: dict, name: str):
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            timings[f"{name}_cancelled"] = True
+
+    @staticmethod
+    def _use_ollama(decision: BotDecision, reply: Optional[str]):
+        if reply and OLLAMA_HANDOFF not in reply.lower():
+            decision.source, decision.text, decision.reason = "ollama", reply, "ollama"
+        elif reply:
+            decision.reason = "handoff"
+
+    async def run(self, message: str, sender_id: str) -> BotDecision:
+        start = time.perf_counter()
+        deadline = start + self.budget
+        decision = BotDecision()
+        timings = decision.timings
+
+        rasa_task = asyncio.create_task(
+            self._timed("rasa", self.query_rasa(message, sender_id), timings, start)
+        )
+        # Deixa o Rasa rodar um passo: uma resposta em cache termina aqui e
+        # evita disparar o Ollama especulativo à toa
+        await asyncio.sleep(0)
+        ollama_task = None
+        if self.speculative and not rasa_task.done():
+            ollama_task = asyncio.create_task(
+                self._timed("ollama", self.query_ollama(message, sender_id), timings, start)
+            )
+
+        try:
+            done, _ = await asyncio.wait({rasa_task}, timeout=max(0.0, deadline - time.perf_counter()))
+            if not done:
+                # Rasa estourou o orçamento; aproveita o Ollama se já respondeu
+                if ollama_task is not None and ollama_task.done():
+                    self._use_ollama(decision, ollama_task.result())
+                if decision.source is None:
+                    decision.reason = "budget_exceeded"
+                return decision
+
+            text = first_rasa_text(rasa_task.result())
+            if text:
+                decision.source, decision.text, decision.reason = "rasa", text, "rasa"
+                return decision
+
+            if ollama_task is None:
+                ollama_start = time.perf_counter()
+                ollama_task = asyncio.create_task(
+                    self._timed("ollama", self.query_ollama(message, sender_id), timings, ollama_start)
+                )
+            done, _ = await asyncio.wait({ollama_task}, timeout=max(0.0, deadline - time.perf_counter()))
+            if not done:
+                decision.reason = "budget_exceeded"
+                return decision
+
+            self._use_ollama(decision, ollama_task.result())
+            return decision
+        finally:
+            await self._cancel(rasa_task, timings, "rasa")
+            await self._cancel(ollama_task, timings, "ollama")
+            timings["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self.outcomes[decision.reason] += 1
+            self.history.append(timings)
+
+    def stats(self):
+        def average(key):
+            values = [t[key] for t in self.history if key in t]
+            return round(sum(values) / len(values), 2) if values else None
+
+        return {
+            "budget_ms": self.budget * 1000,
+            "speculative": self.speculative,
+            "outcomes": dict(self.outcomes),
+            "avg_rasa_ms": average("rasa_ms"),
+            "avg_ollama_ms": average("ollama_ms"),
+            "avg_total_ms": average("total_ms"),
+            "ollama_cancelled": sum(1 for t in self.history if t.get("ollama_cancelled")),
+        }
@@ -0,0 +1,58 @@
+# Versões das conversas para sincronização incremental
+#
+# Toda inserção/alteração de Conversation pelo ORM recebe um número de
+# versão novo, tirado de um contador único no banco (change_sequence) dentro
+# da mesma transação. Assim o painel pode pedir só o que mudou depois da
+# última versão que viu (/conversations/changes?since=) e as listagens têm
+# um ETag barato: a maior versão existente.
+
+import zlib
+
+from sqlalchemy import event, func, text
+from sqlmodel import select
+
+from backend.models import Conversation
+
+SEQUENCE_NAME = "conversation"
+
+
+def _next_version(connection) -> int:
+    # UPDATE primeiro: pega o lock de escrita antes de ler o valor, então
+    # duas transações nunca recebem a mesma versão
+    return connection.execute(
+        text("UPDATE change_sequence SET value = value + 1 WHERE name = :name RETURNING value"),
+        {"name": SEQUENCE_NAME},
+    ).scalar_one()
+
+
+def track_conversation_versions():
+    def assign_version(mapper, connection, target):
+        target.version = _next_version(connection)
+
+    event.listen(Conversation, "before_insert", assign_version)
+    event.listen(Conversation, "before_update", assign_version)
+
+
+async def current_version(session) -> int:
+    return (await session.exec(select(func.coalesce(func.max(Conversation.version), 0)))).one()
+
+
+def list_etag(version: int, user_id, path: str, query_string: str) -> str:
+    # O mesmo URL tem conteúdo diferente por usuário, e listagens diferentes
+    # (/conversations, /conversations/page) não podem compartilhar o ETag
+    digest = zlib.crc32(f"{path}?{query_string}".encode())
+    return f'W/"{version}-{user_id}-{digest:08x}"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    # If-None-Match é uma lista separada por vírgulas; a comparação é fraca
+    # (ignora o prefixo W/) e exata por tag, nunca por substring
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == wanted
+        for tag in if_none_match.split(",")
+    )
@@ -0,0 +1,542 @@
+# Gerenciador de conexões WebSocket
+#
+# Mantém índices por usuário, papel (role) e conversa, para que cada evento
+# vá apenas para quem precisa recebê-lo: o agente atribuído, o criador da
+# conversa, os admins e quem estiver inscrito explicitamente na conversa.
+# O payload é serializado uma única vez e reaproveitado para todos.
+#
+# Cada conexão tem uma fila de saída limitada e uma task escritora própria:
+# o envio apenas enfileira e nunca espera um socket lento. Quando a fila
+# enche, a política de overflow decide entre descartar o mais antigo,
+# substituir o evento pendente com a mesma chave ou desconectar o cliente.
+#
+# Os envios passam pelo barramento de eventos (backend/eventbus.py), para
+# que sockets conectados em outros workers também recebam.
+#
+# Cada evento entregue recebe um número de sequência ("seq") e fica num
+# buffer circular. Um cliente que reconecta com /ws?last_seq=N&epoch=E
+# recebe só o que perdeu; se o buffer já deu a volta (ou o processo é
+# outro), recebe um aviso "resync" para recarregar as listas.
+#
+# Vida das conexões: o endpoint lê o socket continuamente (receive_loop), e
+# uma task de heartbeat manda {"type": "ping"} a cada ping_interval. Qualquer
+# frame do cliente conta como sinal de vida; quem fica mais de idle_timeout
+# sem mandar nada é desconectado. Assim o índice de conexões tem só os
+# agentes que estão de fato conectados.
+#
+# Agrupamento (batch_window > 0): em rajadas, a task escritora junta os
+# eventos pendentes de uma conexão num único frame com um array JSON, no
+# máximo um frame por janela. Um evento isolado sai na hora; só quem acabou
+# de enviar espera o fim da janela. A compressão (permessage-deflate) é
+# negociada pelo uvicorn com cada cliente.
+
+import asyncio
+import json
+import time
+import uuid
+from collections import defaultdict, deque
+from typing import Dict, Iterable, List, Optional, Set
+
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+
+from backend.eventbus import LocalEventBus
+
+
+def _as_user_id(value) -> Optional[int]:
+    # Conversation.assigned_to/created_by são strings no banco
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_event(message: dict) -> str:
+    return json.dumps(jsonable_encoder(message), ensure_ascii=False)
+
+
+def _with_seq(data: str, seq: int) -> str:
+    # Insere o seq no JSON já serializado, sem decodificar de novo
+    if data == "{}":
+        return '{"seq": %d}' % seq
+    return '{"seq": %d, ' % seq + data[1:]
+
+
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+
+class ReplayBuffer:
+    """Últimos eventos entregues por este processo, em ordem de seq.
+
+    Cada entrada guarda o público do evento no momento da entrega (usuário,
+    papel, usuários da conversa ou todos), para que a reexecução vá só para
+    quem teria recebido o evento ao vivo.
+    """
+
+    def __init__(self, size: int = 1000):
+        self.size = size
+        self.entries: deque = deque(maxlen=size)
+        self.seq = 0
+        # Identifica a sequência: muda a cada processo iniciado
+        self.epoch = uuid.uuid4().hex[:12]
+
+    def append(self, audience: tuple, data: str, key=None) -> str:
+        self.seq += 1
+        data = _with_seq(data, self.seq)
+        if self.size:
+            self.entries.append((self.seq, audience, data, key))
+        return data
+
+    @staticmethod
+    def _matches(audience: tuple, user_id: int, role: str) -> bool:
+        kind = audience[0]
+        if kind == "user":
+            return audience[1] == user_id
+        if kind == "role":
+            return audience[1] == role
+        if kind == "conversation":
+            return role == "admin" or user_id in audience[1]
+        return True
+
+    def since(self, last_seq: int, user_id: int, role: str) -> Optional[list]:
+        """Eventos depois de last_seq para o usuário, ou None se houver lacuna."""
+        if last_seq > self.seq:
+            return None
+        if last_seq < self.seq and (not self.entries or self.entries[0][0] > last_seq + 1):
+            return None
+        return [
+            (data, key)
+            for seq, audience, data, key in self.entries
+            if seq > last_seq and self._matches(audience, user_id, role)
+        ]
+
+
+class ClientConnection:
+    def __init__(self, manager, websocket: WebSocket, user_id: int, role: str):
+        self.manager = manager
+        self.websocket = websocket
+        self.user_id = user_id
+        self.role = role
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.connected_at = time.time()
+        self.last_seen = time.monotonic()
+        self.received = 0
+        self.rtt: Optional[float] = None
+        self.sent = 0
+        self.frames = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    def stop(self):
+        self.queue.clear()
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def enqueue(self, data: str, key=None) -> bool:
+        manager = self.manager
+        if len(self.queue) >= manager.max_queue:
+            if manager.overflow_policy == "disconnect":
+                manager.evict(self, "fila de saída cheia")
+                return False
+            if manager.overflow_policy == "coalesce" and key is not None and self._coalesce(data, key):
+                return True
+            self.queue.popleft()
+            self.dropped += 1
+            manager.dropped += 1
+        self.queue.append((data, key))
+        self.wakeup.set()
+        return True
+
+    def _coalesce(self, data: str, key) -> bool:
+        # Substitui o evento pendente mais antigo com a mesma chave
+        for index, (_, queued_key) in enumerate(self.queue):
+            if queued_key == key:
+                del self.queue[index]
+                self.queue.append((data, key))
+                self.coalesced += 1
+                self.manager.coalesced += 1
+                self.wakeup.set()
+                return True
+        return False
+
+    async def _writer(self):
+        manager = self.manager
+        loop = asyncio.get_running_loop()
+        last_send = 0.0
+        while True:
+            if not self.queue:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            count = 1
+            if manager.batch_window > 0:
+                delay = last_send + manager.batch_window - loop.time()
+                if delay > 0 and len(self.queue) < manager.batch_max:
+                    await asyncio.sleep(delay)
+                    if not self.queue:
+                        continue
+                count = min(len(self.queue), manager.batch_max)
+            if count == 1:
+                data = self.queue.popleft()[0]
+            else:
+                # Os eventos já são JSON: o frame é só a concatenação
+                data = "[" + ",".join(self.queue.popleft()[0] for _ in range(count)) + "]"
+            try:
+                await asyncio.wait_for(self.websocket.send_text(data), manager.send_timeout)
+                last_send = loop.time()
+                self.sent += count
+                self.frames += 1
+                self.bytes_sent += len(data)
+                manager.events_sent += count
+                manager.frames_sent += 1
+            except asyncio.TimeoutError:
+                manager.evict(self, "envio excedeu o tempo limite")
+                return
+            except Exception:
+                manager.disconnect(self.websocket)
+                return
+
+    def stats(self, now: float) -> dict:
+        return {
+            "user_id": self.user_id,
+            "role": self.role,
+            "age_seconds": round(time.time() - self.connected_at, 1),
+            "idle_seconds": round(now - self.last_seen, 1),
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "queue_depth": len(self.queue),
+            # Memória retida pela fila de saída (os payloads já serializados)
+            "queued_bytes": sum(len(data) for data, _ in self.queue),
+            "sent": self.sent,
+            "frames": self.frames,
+            "bytes_sent": self.bytes_sent,
+            "received": self.received,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+        }
+
+
+class ConnectionManager:
+    def __init__(self, max_queue: int = 256, overflow_policy: str = "drop_oldest", send_timeout: float = 10.0, bus=None,
+                 replay_size: int = 1000, ping_interval: float = 25.0, idle_timeout: float = 60.0,
+                 batch_window: float = 0.0, batch_max: int = 100):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Política de overflow inválida: {overflow_policy}")
+        self.bus = bus or LocalEventBus()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = False
+        self._pending: Set[asyncio.Task] = set()
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.send_timeout = send_timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.active_connections: List[WebSocket] = []
+        self.connections: Dict[WebSocket, ClientConnection] = {}
+        self.by_user: Dict[int, Set[WebSocket]] = defaultdict(set)
+        self.by_role: Dict[str, Set[WebSocket]] = defaultdict(set)
+        # conversation_id -> ids de usuários inscritos (e o índice reverso)
+        self.subscribers: Dict[int, Set[int]] = defaultdict(set)
+        self.subscriptions: Dict[int, Set[int]] = defaultdict(set)
+        self.replay = ReplayBuffer(replay_size)
+        self.evictions = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.replayed = 0
+        self.resyncs = 0
+        self.reaped = 0
+        self.events_sent = 0
+        self.frames_sent = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.bus.start(self._deliver)
+        self._started = True
+        if self.ping_interval > 0:
+            self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+
+    async def stop(self):
+        self._started = False
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        await self.bus.stop()
+
+    async def connect(self, websocket: WebSocket, user_id: int, role: str,
+                      last_seq: Optional[int] = None, epoch: Optional[str] = None):
+        await websocket.accept()
+        connection = ClientConnection(self, websocket, user_id, role)
+        self.active_connections.append(websocket)
+        self.connections[websocket] = connection
+        self.by_user[user_id].add(websocket)
+        self.by_role[role].add(websocket)
+        # Sem await entre o registro e a reexecução: os eventos perdidos
+        # entram na fila antes de qualquer evento novo
+        self._resume(connection, last_seq, epoch)
+        connection.start()
+
+    def _resume(self, connection: ClientConnection, last_seq: Optional[int], epoch: Optional[str]):
+        replay = self.replay
+        hello = {"type": "hello", "epoch": replay.epoch, "seq": replay.seq}
+        if last_seq is None:
+            connection.enqueue(encode_event(hello))
+            return
+
+        missed = None
+        if epoch is None or epoch == replay.epoch:
+            missed = replay.since(last_seq, connection.user_id, connection.role)
+        if missed is None or len(missed) >= self.max_queue:
+            # Buffer deu a volta, outro processo ou atraso grande demais:
+            # o cliente recarrega as listas em vez de receber eventos soltos
+            self.resyncs += 1
+            connection.enqueue(encode_event({**hello, "type": "resync"}))
+            return
+
+        self.replayed += len(missed)
+        connection.enqueue(encode_event({**hello, "replayed": len(missed)}))
+        for data, key in missed:
+            connection.enqueue(data, key)
+
+    async def receive_loop(self, websocket: WebSocket):
+        """Lê o socket até ele fechar e remove a conexão em seguida."""
+        try:
+            while websocket in self.connections:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                self._handle_client_frame(websocket, message.get("text") or message.get("bytes") or b"")
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            self.disconnect(websocket)
+
+    def _handle_client_frame(self, websocket: WebSocket, raw):
+        connection = self.connections.get(websocket)
+        if connection is None:
+            return
+        connection.last_seen = time.monotonic()
+        connection.received += 1
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get("type") == "ping":
+            connection.enqueue(encode_event({"type": "pong", "ts": data.get("ts")}), key="pong")
+        elif data.get("type") == "pong" and isinstance(data.get("ts"), (int, float)):
+            connection.rtt = max(time.time() - data["ts"], 0.0)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                self.check_liveness()
+            except Exception as e:
+                print("Erro no heartbeat dos WebSockets:", e)
+
+    def check_liveness(self):
+        now = time.monotonic()
+        ping = encode_event({"type": "ping", "ts": time.time()})
+        for connection in list(self.connections.values()):
+            if self.idle_timeout > 0 and now - connection.last_seen > self.idle_timeout:
+                self.reaped += 1
+                self.evict(connection, "sem resposta ao ping")
+            else:
+                connection.enqueue(ping, key="ping")
+
+    def disconnect(self, websocket: WebSocket):
+        if websocket in self.active_connections:
+            self.active_connections.remove(websocket)
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.stop()
+        user_id, role = connection.user_id, connection.role
+        self._discard(self.by_user, user_id, websocket)
+        self._discard(self.by_role, role, websocket)
+        if user_id not in self.by_user:
+            # Último socket do usuário: remove as inscrições dele
+            for conversation_id in self.subscriptions.pop(user_id, set()):
+                self._discard(self.subscribers, conversation_id, user_id)
+
+    def evict(self, connection: ClientConnection, reason: str):
+        self.evictions += 1
+        print(f"WebSocket do usuário {connection.user_id} removido: {reason}")
+        self.disconnect(connection.websocket)
+        asyncio.create_task(self._close(connection.websocket))
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)
+        except Exception:
+            pass
+
+    def stats(self, detail: bool = False):
+        depths = [len(c.queue) for c in self.connections.values()]
+        now = time.time()
+        result = {
+            "connections": len(self.connections),
+            "oldest_connection_seconds": round(max((now - c.connected_at for c in self.connections.values()), default=0), 1),
+            "queued_bytes": sum(len(data) for c in self.connections.values() for data, _ in c.queue),
+            "queue_depth": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "queue_limit": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "evictions": self.evictions,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "epoch": self.replay.epoch,
+            "seq": self.replay.seq,
+            "replay_buffer": len(self.replay.entries),
+            "replay_size": self.replay.size,
+            "replayed": self.replayed,
+            "resyncs": self.resyncs,
+            "ping_interval": self.ping_interval,
+            "idle_timeout": self.idle_timeout,
+            "reaped": self.reaped,
+            "batch_window_ms": self.batch_window * 1000,
+            "events_sent": self.events_sent,
+            "frames_sent": self.frames_sent,
+        }
+        if detail:
+            monotonic = time.monotonic()
+            result["clients"] = [c.stats(monotonic) for c in self.connections.values()]
+        return result
+
+    @staticmethod
+    def _discard(index: dict, key, value):
+        bucket = index.get(key)
+        if bucket is not None:
+            bucket.discard(value)
+            if not bucket:
+                del index[key]
+
+    # Inscrições: podem ser pedidas por rotas síncronas (threadpool), então
+    # são publicadas no barramento sem esperar, como os demais eventos
+    def subscribe(self, user_id: int, conversation_id: int):
+        self._publish_nowait({"op": "subscribe", "user_id": user_id, "conversation_id": conversation_id})
+
+    def unsubscribe(self, user_id: int, conversation_id: int):
+        self._publish_nowait({"op": "unsubscribe", "user_id": user_id, "conversation_id": conversation_id})
+
+    def drop_conversation(self, conversation_id: int):
+        self._publish_nowait({"op": "drop_conversation", "conversation_id": conversation_id})
+
+    def _apply_subscription(self, envelope: dict):
+        op = envelope["op"]
+        conversation_id = envelope["conversation_id"]
+        if op == "drop_conversation":
+            for user_id in self.subscribers.pop(conversation_id, set()):
+                self._discard(self.subscriptions, user_id, conversation_id)
+            return
+        user_id = envelope["user_id"]
+        if op == "unsubscribe":
+            self._discard(self.subscribers, conversation_id, user_id)
+            self._discard(self.subscriptions, user_id, conversation_id)
+        elif user_id in self.by_user:
+            self.subscribers[conversation_id].add(user_id)
+            self.subscriptions[user_id].add(conversation_id)
+
+    def conversation_recipients(self, conversation_id: int, assigned_to=None, created_by=None) -> Set[WebSocket]:
+        user_ids = set(self.subscribers.get(conversation_id, ()))
+        for value in (assigned_to, created_by):
+            user_id = _as_user_id(value)
+            if user_id is not None:
+                user_ids.add(user_id)
+
+        sockets = set(self.by_role.get("admin", ()))
+        for user_id in user_ids:
+            sockets.update(self.by_user.get(user_id, ()))
+        return sockets
+
+    def _audience(self, target: dict) -> tuple:
+        kind = target["type"]
+        if kind == "user":
+            return ("user", target["user_id"])
+        if kind == "role":
+            return ("role", target["role"])
+        if kind == "conversation":
+            user_ids = set(self.subscribers.get(target["conversation_id"], ()))
+            for value in (target.get("assigned_to"), target.get("created_by")):
+                user_id = _as_user_id(value)
+                if user_id is not None:
+                    user_ids.add(user_id)
+            return ("conversation", frozenset(user_ids))
+        return ("all",)
+
+    def _local_recipients(self, target: dict) -> Iterable[WebSocket]:
+        kind = target["type"]
+        if kind == "user":
+            return self.by_user.get(target["user_id"], ())
+        if kind == "role":
+            return self.by_role.get(target["role"], ())
+        if kind == "conversation":
+            return self.conversation_recipients(
+                target["conversation_id"], target.get("assigned_to"), target.get("created_by")
+            )
+        return self.active_connections
+
+    async def _deliver(self, envelope: dict):
+        # Chamado pelo barramento em cada processo
+        if envelope.get("op") != "event":
+            self._apply_subscription(envelope)
+            return
+        # Apenas enfileira: quem publica nunca espera por um socket lento
+        key = envelope.get("key")
+        data = self.replay.append(self._audience(envelope["target"]), envelope["data"], key)
+        for websocket in list(self._local_recipients(envelope["target"])):
+            connection = self.connections.get(websocket)
+            if connection is not None:
+                connection.enqueue(data, key)
+
+    async def _publish(self, envelope: dict):
+        if self._started:
+            await self.bus.publish(envelope)
+        else:
+            await self._deliver(envelope)
+
+    def _publish_nowait(self, envelope: dict):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self.loop is None:
+                self._apply_subscription(envelope)
+            else:
+                asyncio.run_coroutine_threadsafe(self._publish(envelope), self.loop)
+            return
+        task = asyncio.create_task(self._publish(envelope))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _send(self, target: dict, message: dict, key=None):
+        # O payload é serializado uma vez, antes de ir para o barramento
+        await self._publish({"op": "event", "target": target, "data": encode_event(message), "key": key})
+
+    async def send_personal_message(self, message: dict, user_id: int, key=None):
+        await self._send({"type": "user", "user_id": user_id}, message, key)
+
+    async def send_to_role(self, message: dict, role: str, key=None):
+        await self._send({"type": "role", "role": role}, message, key)
+
+    async def send_conversation_event(self, message: dict, conversation, key=None):
+        target = {
+            "type": "conversation",
+            "conversation_id": conversation.id,
+            "assigned_to": conversation.assigned_to,
+            "created_by": conversation.created_by,
+        }
+        await self._send(target, message, key)
+
+    async def broadcast(self, message: dict, key=None):
+        await self._send({"type": "all"}, message, key)
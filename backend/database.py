@@ -0,0 +1,79 @@
+# Banco de dados
+#
+# Engine assíncrona (aiosqlite) para as rotas, e a engine síncrona original
+# como fallback para hooks de startup, migrações e scripts. As duas usam
+# WAL e os mesmos pragmas, para que leituras não esperem pelas escritas.
+
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlmodel import create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.metrics import instrument_engine
+from backend.query_profiler import QueryProfiler
+
+# Scripts (python -m backend.archive, backend.search) importam só este módulo
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./chatwoot_clone.db")
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-20000"),  # negativo = KiB
+    "temp_store": "MEMORY",
+}
+
+
+def async_database_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    return url
+
+
+def _apply_sqlite_pragmas(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+# SQL_ECHO=1 volta a imprimir todo SQL; para achar consultas lentas use o
+# profiler (DB_PROFILE=1 e /admin/queries)
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+
+query_profiler = QueryProfiler(
+    enabled=os.getenv("DB_PROFILE", "0") == "1",
+    slow_threshold=float(os.getenv("DB_SLOW_QUERY_MS", "100")) / 1000,
+    explain=os.getenv("DB_EXPLAIN_SLOW", "1") == "1",
+)
+
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO)
+_apply_sqlite_pragmas(engine)
+instrument_engine(engine, query_profiler)
+
+async_engine = create_async_engine(
+    async_database_url(DATABASE_URL),
+    pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    pool_pre_ping=True,
+    echo=SQL_ECHO,
+)
+_apply_sqlite_pragmas(async_engine.sync_engine)
+instrument_engine(async_engine.sync_engine, query_profiler)
+
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
@@ -0,0 +1,86 @@
+# Barramento de eventos entre processos
+#
+# O ConnectionManager publica cada evento no barramento, e cada processo
+# entrega aos sockets que ele mesmo mantém. Com o LocalEventBus tudo fica
+# no próprio processo (um worker, testes); com o RedisEventBus os eventos
+# passam por um canal pub/sub do Redis e chegam a todos os workers/nós.
+
+import asyncio
+import json
+from typing import Awaitable, Callable, Optional
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class LocalEventBus:
+    def __init__(self):
+        self.handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self.handler = handler
+
+    async def publish(self, envelope: dict):
+        await self.handler(envelope)
+
+    async def stop(self):
+        self.handler = None
+
+
+class RedisEventBus:
+    def __init__(self, url: str, channel: str = "chat:events", reconnect_delay: float = 1.0):
+        self.url = url
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.redis = None
+        self.handler: Optional[Handler] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self, handler: Handler):
+        import redis.asyncio as aioredis
+
+        self.handler = handler
+        self.redis = aioredis.from_url(self.url)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def publish(self, envelope: dict):
+        await self.redis.publish(self.channel, json.dumps(envelope, ensure_ascii=False))
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for item in pubsub.listen():
+                    if item.get("type") != "message":
+                        continue
+                    try:
+                        await self.handler(json.loads(item["data"]))
+                    except Exception as e:
+                        print("Erro ao processar evento do Redis:", e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print("Conexão com o Redis perdida, reconectando:", e)
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+
+def create_event_bus(kind: str, redis_url: Optional[str] = None):
+    if kind == "redis":
+        return RedisEventBus(redis_url or "redis://localhost:6379")
+    if kind == "local":
+        return LocalEventBus()
+    raise ValueError(f"Barramento de eventos desconhecido: {kind}")
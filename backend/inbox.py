@@ -0,0 +1,270 @@
+# Caixa de entrada durável do webhook do WhatsApp
+#
+# O webhook só grava o evento bruto na tabela inboundevent e responde 200;
+# workers em segundo plano processam os eventos (bots, banco, envios). O
+# MessageSid do Twilio é único na tabela, então retentativas do Twilio não
+# geram mensagens nem respostas duplicadas.
+#
+# Com vários workers, cada evento tem um dono e um lease: quem grava o
+# evento já é o dono, e process() só roda o handler depois de reivindicar o
+# evento com um UPDATE condicional (atômico no banco). Cada worker renova
+# periodicamente o lease de todos os seus eventos (na fila ou rodando) e
+# adota os eventos cujo lease expirou: os de um worker que caiu e os
+# devolvidos por um que parou (stop() libera os que ainda eram dele).
+#
+# Os eventos passam por um KeyedScheduler com o número do cliente como
+# chave: mensagens do mesmo cliente são processadas em ordem (inclusive as
+# retentativas, que seguram o shard), clientes diferentes em paralelo.
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import and_, delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select
+
+from backend.keyed_scheduler import KeyedScheduler
+from backend.models import InboundEvent
+
+
+class WebhookInbox:
+    def __init__(
+        self,
+        session_maker,
+        handler: Callable[[InboundEvent], Awaitable],
+        workers: int = 4,
+        max_attempts: int = 5,
+        retry_delay: float = 2.0,
+        retention: float = 72 * 3600,
+        lease: float = 60.0,
+    ):
+        self.session_maker = session_maker
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retention = retention
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.scheduler = KeyedScheduler(self.process, shards=workers)
+        self.tasks = []
+        self.accepted = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.replayed = 0
+        self.lost_claims = 0
+
+    async def start(self):
+        if self.tasks:
+            return
+        await self.prune()
+        await self.recover()
+        self.scheduler.start()
+        self.tasks = [
+            asyncio.create_task(self._prune_periodically()),
+            asyncio.create_task(self._keep_leases()),
+        ]
+
+    async def stop(self):
+        await self.scheduler.stop()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self._release()
+
+    async def recover(self) -> int:
+        """Adota os eventos sem dono vivo (lease vencido ou liberado) e os põe na fila."""
+        async with self.session_maker() as session:
+            rows = (await session.exec(
+                update(InboundEvent)
+                .where(InboundEvent.status.in_(("pending", "processing")), self._lease_free(self._now()))
+                .values(status="pending", owner=self.owner, lease_until=self._lease_deadline())
+                .returning(InboundEvent.id, InboundEvent.from_number)
+            )).all()
+            await session.commit()
+        for event_id, from_number in sorted(rows):
+            self.scheduler.submit(from_number, event_id)
+        self.replayed += len(rows)
+        if rows:
+            print(f"Reprocessando {len(rows)} eventos do webhook")
+        return len(rows)
+
+    async def _keep_leases(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self._renew_leases()
+                await self.recover()
+            except Exception as e:
+                print(f"Erro ao renovar os leases da caixa de entrada: {e}")
+
+    async def _renew_leases(self):
+        # Vale para os eventos na fila também: um shard lento não perde os seus
+        async with self.session_maker() as session:
+            await session.exec(
+                update(InboundEvent)
+                .where(InboundEvent.owner == self.owner, InboundEvent.status.in_(("pending", "processing")))
+                .values(lease_until=self._lease_deadline())
+            )
+            await session.commit()
+
+    async def _release(self):
+        # Quem subir depois (ou outro worker vivo) retoma sem esperar o lease vencer
+        try:
+            async with self.session_maker() as session:
+                await session.exec(
+                    update(InboundEvent)
+                    .where(InboundEvent.owner == self.owner, InboundEvent.status.in_(("pending", "processing")))
+                    .values(status="pending", owner=None, lease_until=None)
+                )
+                await session.commit()
+        except Exception as e:
+            print(f"Erro ao liberar os eventos da caixa de entrada: {e}")
+
+    async def accept(self, message_sid: str, from_number: str, body: str, profile_name: Optional[str]):
+        """Grava o evento; devolve (evento, False) se o MessageSid já existe."""
+        event = InboundEvent(
+            message_sid=message_sid,
+            from_number=from_number,
+            body=body,
+            profile_name=profile_name,
+            owner=self.owner,
+            lease_until=self._lease_deadline(),
+        )
+        async with self.session_maker() as session:
+            session.add(event)
+            try:
+                await session.commit()
+            except IntegrityError:
+                await session.rollback()
+                self.duplicates += 1
+                existing = (await session.exec(
+                    select(InboundEvent).where(InboundEvent.message_sid == message_sid)
+                )).first()
+                return existing, False
+        self.accepted += 1
+        self.scheduler.submit(from_number, event.id)
+        return event, True
+
+    async def _set_status(self, event_id: int, **values):
+        async with self.session_maker() as session:
+            await session.exec(update(InboundEvent).where(InboundEvent.id == event_id).values(**values))
+            await session.commit()
+
+    async def record(self, event_id: int, **values):
+        """Grava o progresso do handler no evento, para uma retentativa não repetir o que já fez."""
+        await self._set_status(event_id, **values)
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc)
+
+    def _lease_deadline(self, extra: float = 0.0):
+        return self._now() + timedelta(seconds=self.lease + extra)
+
+    @staticmethod
+    def _lease_free(now):
+        # Sem lease (eventos de antes da coluna existir) ou com lease vencido
+        return or_(InboundEvent.lease_until.is_(None), InboundEvent.lease_until < now)
+
+    async def _claim(self, event_id: int) -> Optional[InboundEvent]:
+        """Reivindica o evento para este worker; None se ele já terminou ou tem outro dono vivo."""
+        now = self._now()
+        async with self.session_maker() as session:
+            result = await session.exec(
+                update(InboundEvent)
+                .where(
+                    InboundEvent.id == event_id,
+                    or_(
+                        and_(
+                            InboundEvent.status == "pending",
+                            or_(InboundEvent.owner.is_(None), InboundEvent.owner == self.owner),
+                        ),
+                        and_(InboundEvent.status.in_(("pending", "processing")), self._lease_free(now)),
+                    ),
+                )
+                .values(
+                    status="processing",
+                    owner=self.owner,
+                    lease_until=self._lease_deadline(),
+                    attempts=InboundEvent.attempts + 1,
+                )
+            )
+            await session.commit()
+            if result.rowcount != 1:
+                return None
+            return await session.get(InboundEvent, event_id)
+
+    async def process(self, event_id: int):
+        while True:
+            event = await self._claim(event_id)
+            if event is None:
+                # Já processado, ou outro worker vivo está com ele
+                async with self.session_maker() as session:
+                    current = await session.get(InboundEvent, event_id)
+                if current is not None and current.status not in ("done", "failed"):
+                    self.lost_claims += 1
+                return
+
+            try:
+                await self.handler(event)
+            except Exception as e:
+                print(f"Erro ao processar evento {event.message_sid}: {e}")
+                if event.attempts >= self.max_attempts:
+                    self.failed += 1
+                    await self._set_status(event_id, status="failed", last_error=str(e)[:500])
+                    return
+                self.retried += 1
+                delay = self.retry_delay * event.attempts
+                # Continua dono do evento durante a espera
+                await self._set_status(
+                    event_id, status="pending", last_error=str(e)[:500], lease_until=self._lease_deadline(delay)
+                )
+                # Retenta no próprio shard para não passar na frente de
+                # mensagens do mesmo cliente
+                await asyncio.sleep(delay)
+                continue
+
+            self.processed += 1
+            await self._set_status(event_id, status="done", processed_at=datetime.now(timezone.utc))
+            return
+
+    async def _prune_periodically(self):
+        while True:
+            await asyncio.sleep(3600)
+            try:
+                await self.prune()
+            except Exception as e:
+                print(f"Erro ao limpar a caixa de entrada: {e}")
+
+    async def prune(self):
+        # Eventos processados só servem para deduplicar retentativas do Twilio
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention)
+        async with self.session_maker() as session:
+            await session.exec(
+                delete(InboundEvent).where(InboundEvent.status == "done", InboundEvent.received_at < cutoff)
+            )
+            await session.commit()
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_depth": self.scheduler.depth(),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "replayed": self.replayed,
+            "lost_claims": self.lost_claims,
+            "owner": self.owner,
+            "lease_s": self.lease,
+            "scheduler": self.scheduler.stats(),
+        }
@@ -0,0 +1,101 @@
+# Escalonador por chave
+#
+# O trabalho é distribuído em shards pelo hash da chave (número do cliente):
+# cada shard tem uma fila e um worker, então itens da mesma chave rodam em
+# ordem estrita e chaves diferentes rodam em paralelo. O custo é o bloqueio
+# de cabeça de fila: um item lento atrasa os demais do mesmo shard, por isso
+# stats() mostra a profundidade e a idade do item mais antigo de cada shard.
+
+import asyncio
+import statistics
+import time
+import zlib
+from collections import deque
+from typing import Any, Awaitable, Callable, Optional
+
+
+class _Shard:
+    def __init__(self):
+        self.items = deque()  # (enfileirado_em, item)
+        self.wakeup = asyncio.Event()
+        self.current_since: Optional[float] = None
+        self.processed = 0
+        self.errors = 0
+
+
+class KeyedScheduler:
+    def __init__(self, handler: Callable[[Any], Awaitable], shards: int = 4, history_size: int = 1000):
+        self.handler = handler
+        self.shards = [_Shard() for _ in range(max(1, shards))]
+        self.tasks = []
+        # Tempo de espera na fila de cada item, para percentis
+        self.waits = deque(maxlen=history_size)
+
+    def shard_for(self, key: str) -> int:
+        # crc32 em vez de hash(): estável entre processos e reinícios
+        return zlib.crc32(key.encode("utf-8")) % len(self.shards)
+
+    def submit(self, key: str, item: Any):
+        shard = self.shards[self.shard_for(key)]
+        shard.items.append((time.perf_counter(), item))
+        shard.wakeup.set()
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._run(shard)) for shard in self.shards]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _run(self, shard: _Shard):
+        while True:
+            if not shard.items:
+                shard.wakeup.clear()
+                await shard.wakeup.wait()
+                continue
+            enqueued_at, item = shard.items.popleft()
+            shard.current_since = enqueued_at
+            self.waits.append(time.perf_counter() - enqueued_at)
+            try:
+                await self.handler(item)
+            except Exception as e:
+                shard.errors += 1
+                print(f"Erro no escalonador: {e}")
+            finally:
+                shard.current_since = None
+                shard.processed += 1
+
+    def depth(self) -> int:
+        return sum(len(shard.items) for shard in self.shards)
+
+    def stats(self):
+        now = time.perf_counter()
+        shards = []
+        for index, shard in enumerate(self.shards):
+            # Cabeça da fila: o item em processamento ou, se nenhum, o próximo
+            head = shard.current_since
+            if head is None and shard.items:
+                head = shard.items[0][0]
+            shards.append({
+                "shard": index,
+                "depth": len(shard.items),
+                "busy": shard.current_since is not None,
+                "head_of_line_ms": round((now - head) * 1000, 2) if head is not None else 0.0,
+                "processed": shard.processed,
+                "errors": shard.errors,
+            })
+        waits = sorted(self.waits)
+        return {
+            "shards": shards,
+            "depth": self.depth(),
+            "max_head_of_line_ms": max(s["head_of_line_ms"] for s in shards),
+            "queue_wait_ms": {
+                "count": len(waits),
+                "p50": round(statistics.median(waits) * 1000, 2) if waits else None,
+                "p95": round(waits[int(len(waits) * 0.95) - 1] * 1000, 2) if len(waits) >= 20 else None,
+                "max": round(waits[-1] * 1000, 2) if waits else None,
+            },
+        }
@@ -1,10 +1,13 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, Query, Form
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
-from sqlmodel import Field, SQLModel, Session, create_engine, select
+from sqlalchemy import func, update
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Field, SQLModel, Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from datetime import datetime, timedelta
 from typing import Optional, List
 from jose import JWTError, jwt
@@ -14,18 +17,40 @@ from pydantic import BaseModel
 from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv 
 from datetime import timezone
-from sqlalchemy import text, inspect
 from pytz import timezone as tz
 
+# Antes dos módulos do backend: vários leem o ambiente ao serem importados
+load_dotenv()
+
+from backend.models import User, Conversation, Message, Usuario, InboundEvent
+from backend.database import DATABASE_URL, engine, async_engine, async_session_maker, get_async_session, query_profiler
+from backend.migrations import run_migrations
+from backend.outbound import OutboundDispatcher, TwilioTransport, FakeTransport
+from backend.connections import ConnectionManager
+from backend.eventbus import create_event_bus
+from backend.agent_load import AgentLoadTracker
+from backend.auth_cache import AuthCache
+from backend.bot_clients import BotClient, CircuitBreaker
+from backend.bot_pipeline import BotPipeline, OLLAMA_HANDOFF
+from backend.bot_cache import BotResponseCache
+from backend.inbox import WebhookInbox
+from backend.write_batcher import GroupCommitWriter
+from backend.archive import ConversationArchive, database_size
+from backend.search import build_match_query, fill_archived_results, search_messages
+from backend.change_feed import track_conversation_versions, current_version, list_etag, etag_matches
+from backend.metrics import (
+    REGISTRY, HTTP_REQUEST_SECONDS, HTTP_REQUEST_DB_QUERIES, WEBHOOK_STAGE_SECONDS, WEBHOOK_EVENTS,
+    WHATSAPP_SEND_SECONDS, start_request_tracking, finish_request_tracking,
+)
+
 import bcrypt
-import httpx
 import os
+import time
+import uuid
 import asyncio
 import uvicorn
 import requests
 
-load_dotenv()
-
 app = FastAPI()
 
 # CORS
@@ -37,9 +62,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Banco de dados
-DATABASE_URL = "sqlite:///./chatwoot_clone.db"
-engine = create_engine(DATABASE_URL, echo=True)
+# Métricas por rota: latência e número de consultas ao banco
+@app.middleware("http")
+async def collect_request_metrics(request: Request, call_next):
+    tracking = start_request_tracking()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        queries = finish_request_tracking(tracking)
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=path, status=status)
+        HTTP_REQUEST_DB_QUERIES.observe(len(queries), route=path)
+
+# Banco de dados: engine síncrona e assíncrona em backend/database.py
 
 
 
@@ -68,6 +108,13 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
+# Cache de tokens/usuários autenticados
+auth_cache = AuthCache(
+    max_size=int(os.getenv("AUTH_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("AUTH_CACHE_TTL", "60")),
+)
+auth_cache.watch_user_changes()
+
 # Twilio (opcional, pode remover se não for usar)
 TWILIO_ACCOUNT_SID = os.getenv("TWILIO_ACCOUNT_SID") or "SEU_ACCOUNT_SID"
 TWILIO_AUTH_TOKEN = os.getenv("TWILIO_AUTH_TOKEN") or "SEU_AUTH_TOKEN"
@@ -75,43 +122,58 @@ TWILIO_WHATSAPP_FROM = os.getenv("TWILIO_WHATSAPP_FROM")
 TO = 'whatsapp:+5531996950370'
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
-
-# Modelos
-class User(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    email: str
-    name: str
-    password_hash: str
-    role: str
+# Envio assíncrono (fila + workers). WHATSAPP_TRANSPORT=fake usa um transporte local
+WHATSAPP_TRANSPORT = os.getenv("WHATSAPP_TRANSPORT", "twilio")
+if WHATSAPP_TRANSPORT == "fake":
+    whatsapp_transport = FakeTransport(
+        latency=float(os.getenv("WHATSAPP_FAKE_LATENCY_MS", "50")) / 1000,
+        failure_rate=float(os.getenv("WHATSAPP_FAKE_FAILURE_RATE", "0")),
+    )
+else:
+    whatsapp_transport = TwilioTransport(twilio_client, TWILIO_WHATSAPP_FROM)
+
+outbound = OutboundDispatcher(
+    whatsapp_transport,
+    workers=int(os.getenv("OUTBOUND_WORKERS", "4")),
+    rate_per_sender=float(os.getenv("OUTBOUND_RATE_PER_SENDER", "5")),
+    max_retries=int(os.getenv("OUTBOUND_MAX_RETRIES", "3")),
+    on_send=lambda seconds, ok: WHATSAPP_SEND_SECONDS.observe(seconds, result="ok" if ok else "error"),
+)
 
 
-class Conversation(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    customer_number: str
-    name: Optional[str] = None
-    assigned_to: str | None
-    created_by: str
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    status: str = "pending"
+# Bots (Rasa e Ollama): clientes com pool, timeout e circuit breaker
+def make_bot_client(name: str, url: str, timeout: float) -> BotClient:
+    return BotClient(
+        name,
+        url,
+        timeout=timeout,
+        connect_timeout=float(os.getenv("BOT_CONNECT_TIMEOUT", "1")),
+        max_connections=int(os.getenv("BOT_MAX_CONNECTIONS", "20")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("BOT_BREAKER_FAILURES", "3")),
+            reset_timeout=float(os.getenv("BOT_BREAKER_RESET_SECONDS", "30")),
+        ),
+    )
 
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# Geração em streaming: respostas parciais vão para os supervisores via WebSocket
+OLLAMA_STREAM = os.getenv("OLLAMA_STREAM", "1") == "1"
+OLLAMA_STREAM_PUSH_INTERVAL = float(os.getenv("OLLAMA_STREAM_PUSH_MS", "150")) / 1000
+rasa_client = make_bot_client("rasa", os.getenv("RASA_URL", "http://localhost:5005"), float(os.getenv("RASA_TIMEOUT", "3")))
+# Cache de respostas dos bots (BOT_CACHE_PATH salva em disco entre reinícios)
+bot_cache = BotResponseCache(
+    max_size=int(os.getenv("BOT_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("BOT_CACHE_TTL", "3600")),
+    path=os.getenv("BOT_CACHE_PATH") or None,
+)
+ollama_client = make_bot_client("ollama", os.getenv("OLLAMA_URL", "http://localhost:11434"), float(os.getenv("OLLAMA_TIMEOUT", "20")))
 
-class Message(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    conversation_id: int
-    sender: str
-    content: str
-    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Modelos
 class ConversationCreate(BaseModel):
     customer_number: str
     initial_message: str
 
-class Usuario(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    nome: str
-    email: str
-    senha: str
-
 class UsuarioCreate(BaseModel):
     nome: str
     email: str
@@ -121,37 +183,43 @@ class UsuarioCreate(BaseModel):
 
 
 # WebSocket Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+manager = ConnectionManager(
+    max_queue=int(os.getenv("WS_SEND_QUEUE_SIZE", "256")),
+    overflow_policy=os.getenv("WS_OVERFLOW_POLICY", "drop_oldest"),
+    send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10")),
+    # Eventos guardados para quem reconecta com last_seq
+    replay_size=int(os.getenv("WS_REPLAY_BUFFER", "1000")),
+    # Heartbeat: ping a cada WS_PING_INTERVAL s; sem resposta por WS_IDLE_TIMEOUT s, desconecta
+    ping_interval=float(os.getenv("WS_PING_INTERVAL", "25")),
+    idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", "60")),
+    # Agrupa rajadas em um frame (array JSON) por janela de WS_BATCH_MS ms; 0 desliga
+    batch_window=float(os.getenv("WS_BATCH_MS", "0")) / 1000,
+    batch_max=int(os.getenv("WS_BATCH_MAX", "100")),
+    # EVENT_BUS=redis permite rodar com vários workers/nós
+    bus=create_event_bus(os.getenv("EVENT_BUS", "local"), os.getenv("REDIS_URL")),
+)
 
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
 
-    async def send_personal_message(self, message: dict, recipienet_number: str):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json({
-                    "to": recipienet_number,
-                    **message
-                })
-            except Exception:
-                self.disconnect(connection)
-
-    async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                self.disconnect(connection)
+# Conversas pendentes por agente, para a atribuição automática
+agent_loads = AgentLoadTracker()
 
+# Inserções de Message/Conversation agrupadas em um commit por lote
+writer = GroupCommitWriter(
+    async_session_maker,
+    max_batch=int(os.getenv("WRITE_BATCH_MAX", "500")),
+    max_delay=float(os.getenv("WRITE_BATCH_DELAY_MS", "2")) / 1000,
+)
 
-manager = ConnectionManager()
+# Conversas encerradas há mais de ARCHIVE_AFTER_DAYS dias saem do banco
+# quente para segmentos comprimidos em ARCHIVE_DIR
+archive = ConversationArchive(
+    engine,
+    os.getenv("ARCHIVE_DIR", "./archive"),
+    min_age=float(os.getenv("ARCHIVE_AFTER_DAYS", "30")) * 86400,
+    batch_size=int(os.getenv("ARCHIVE_BATCH_SIZE", "200")),
+    segment_max_bytes=int(os.getenv("ARCHIVE_SEGMENT_MB", "64")) * 1024 * 1024,
+    cache_size=int(os.getenv("ARCHIVE_CACHE_SIZE", "64")),
+)
 
 
 class MessagePayload(BaseModel):
@@ -160,21 +228,86 @@ class MessagePayload(BaseModel):
 # Cria as tabelas no banco
 SQLModel.metadata.create_all(engine)
 
+# Toda alteração de conversa pelo ORM ganha uma versão nova
+track_conversation_versions()
+
+
+
+@app.on_event("startup")
+def aplicar_migracoes():
+    run_migrations(engine)
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
 
 
 @app.on_event("startup")
-def verificar_e_adicionar_coluna_name():
-    with engine.connect() as conn:
-        insp = inspect(conn)
-        columns = [col["name"] for col in insp.get_columns("conversation")]
+async def start_outbound():
+    await outbound.start()
+
+
+@app.on_event("shutdown")
+async def stop_outbound():
+    await outbound.stop()
+
+
+@app.on_event("startup")
+async def start_bot_clients():
+    await rasa_client.start()
+    await ollama_client.start()
+    bot_cache.load()
+    if bot_cache.path:
+        asyncio.create_task(save_bot_cache_periodically())
+
+
+async def save_bot_cache_periodically():
+    interval = float(os.getenv("BOT_CACHE_SAVE_SECONDS", "300"))
+    while interval > 0:
+        await asyncio.sleep(interval)
+        try:
+            # A cópia é feita aqui: a thread não percorre o dict enquanto o loop o altera
+            rows = bot_cache.snapshot()
+            await asyncio.to_thread(bot_cache.save, rows)
+        except Exception as e:
+            print("Erro ao salvar cache dos bots:", e)
+
+
+@app.on_event("shutdown")
+async def stop_bot_clients():
+    await rasa_client.stop()
+    await ollama_client.stop()
+    bot_cache.save()
+
+
+@app.on_event("startup")
+async def start_event_bus():
+    await manager.start()
+
 
-        if "name" not in columns:
-            print("Adicionando coluna 'name' à tabela conversation")
-            conn.execute(text("ALTER TABLE conversation ADD COLUMN name VARCHAR"))
-            conn.commit()
-#with engine.connect() as conn:
-   # conn.execute(text("ALTER TABLE conversation ADD COLUMN name VARCHAR"))
-    #conn.commit()
+@app.on_event("shutdown")
+async def stop_event_bus():
+    await manager.stop()
+
+
+@app.on_event("startup")
+async def load_agent_loads():
+    async with AsyncSession(async_engine) as session:
+        await agent_loads.rebuild(session)
+    asyncio.create_task(resync_agent_loads())
+
+
+async def resync_agent_loads():
+    # Corrige desvios causados por outros workers ou por alterações fora da API
+    interval = float(os.getenv("AGENT_LOAD_RESYNC_SECONDS", "300"))
+    while interval > 0:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSession(async_engine) as session:
+                await agent_loads.rebuild(session)
+        except Exception as e:
+            print("Erro ao recalcular carga dos agentes:", e)
 
 
 # Utils
@@ -206,7 +339,7 @@ def create_admin_user():
         session.commit()
      
 @app.post("/send_welcome_message/{to_number}")
-def enviar_mensagem(tipo: str, to_number: str, nome: str = ""):
+async def enviar_mensagem(tipo: str, to_number: str, nome: str = ""):
     if tipo == "boas_vindas":
         mensagem = f"Olá {nome}, um operador entrará em contato com você em breve"
     elif tipo == "encerramento":
@@ -216,9 +349,10 @@ def enviar_mensagem(tipo: str, to_number: str, nome: str = ""):
     else:
         mensagem = "Mensagem automática do sistema."
 
-    return send_whatsapp_message(to_number, mensagem)
+    return await send_whatsapp_message(to_number, mensagem)
 
 
+# Sessões síncronas (fallback para scripts; as rotas usam get_async_session)
 def get_db():
     with Session(engine) as session:
         yield session
@@ -245,19 +379,28 @@ def create_token(data: dict, expires_delta: timedelta = None):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+async def authenticate_token(token: str) -> User:
+    # Caminho quente: token já resolvido está no cache, sem decode nem banco
+    user = auth_cache.get(token)
+    if user is not None:
+        return user
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
         if email is None:
             raise HTTPException(status_code=401, detail="Token inválido")
-        user = session.exec(select(User).where(User.email == email)).first()
+        async with AsyncSession(async_engine) as session:
+            user = (await session.exec(select(User).where(User.email == email))).first()
         if user is None:
             raise HTTPException(status_code=401, detail="Usuário não encontrado")
+        auth_cache.put(token, user, payload.get("exp"))
         return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Token inválido")
 
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await authenticate_token(token)
+
 
 
 def get_ngrok_url():
@@ -278,124 +421,200 @@ else:
     print("Não foi possível obter a URL pública do ngrok")
 
 # Envia mensagem pelo WhatsApp (opcional)
-def send_whatsapp_message(to_number: str, message: str):
-    try:
-        msg = twilio_client.messages.create(
-            body=message,
-            from_=TWILIO_WHATSAPP_FROM,
-            to=f"whatsapp:{to_number}"
-        )
-        print(F"Mensagem enviaad para {to_number}: {msg.sid}")
-        return msg.sid
-    except Exception as e:
-        print(f"Erro ao enviar mensagem via WhatsApp: {e}")
-        return None
+async def send_whatsapp_message(to_number: str, message: str):
+    # Enfileirado no dispatcher (não bloqueia o event loop); o status do envio
+    # fica em /deliveries/{delivery_id}
+    delivery = await outbound.enqueue(to_number, message)
+    print(f"Mensagem enfileirada para {to_number}: {delivery.id}")
+    return delivery.id
+
+def can_access_conversation(user: User, conversation: Conversation) -> bool:
+    # assigned_to/created_by são gravados como texto no banco
+    return (
+        user.role == "admin"
+        or str(conversation.assigned_to) == str(user.id)
+        or str(conversation.created_by) == str(user.id)
+    )
+
+
+# Paginação por cursor (keyset): before_id/after_id em vez de OFFSET
+MAX_PAGE_SIZE = 200
+
+async def fetch_page(session: AsyncSession, query, column, response: Response,
+                     before_id: Optional[int] = None, after_id: Optional[int] = None,
+                     limit: Optional[int] = None):
+    # Sem after_id, a página é a mais recente (ordem decrescente no banco);
+    # o resultado sempre volta em ordem crescente de id
+    newest_first = after_id is None and limit is not None
+    if before_id is not None:
+        query = query.where(column < before_id)
+    if after_id is not None:
+        query = query.where(column > after_id)
+    query = query.order_by(column.desc() if newest_first else column)
+    if limit is not None:
+        query = query.limit(limit + 1)
+
+    rows = list((await session.exec(query)).all())
+    if limit is not None:
+        response.headers["X-Has-More"] = "true" if len(rows) > limit else "false"
+        rows = rows[:limit]
+    if newest_first:
+        rows.reverse()
+    return rows
+
+
+def page_from_list(rows: list, response: Response, before_id: Optional[int] = None,
+                   after_id: Optional[int] = None, limit: Optional[int] = None):
+    # Mesma semântica de fetch_page para linhas já em memória, em ordem de id
+    if before_id is not None:
+        rows = [row for row in rows if row["id"] < before_id]
+    if after_id is not None:
+        rows = [row for row in rows if row["id"] > after_id]
+    if limit is not None:
+        response.headers["X-Has-More"] = "true" if len(rows) > limit else "false"
+        rows = rows[:limit] if after_id is not None else rows[-limit:]
+    return rows
+
+
+# ETag das listagens de conversas: a maior versão muda a cada alteração,
+# então um painel parado recebe 304 sem serializar a tabela
+async def conversations_etag(request: Request, response: Response, session: AsyncSession, user: User):
+    version = await current_version(session)
+    etag = list_etag(version, user.id, request.url.path, request.url.query)
+    response.headers["ETag"] = etag
+    response.headers["X-Conversations-Version"] = str(version)
+    not_modified = etag_matches(etag, request.headers.get("if-none-match", ""))
+    return etag, not_modified
+
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
 
-def get_least_busy_agent(session: Session):
-    agents = session.exec(select(User).where(User.role == "agent")).all()
-    if not agents:
-        return None
-    
-    agent_loads = {
-        agent.id: session.exec(
-            select(Conversation).where(
-                Conversation.assigned_to == agent.id,
-                Conversation.status == "pending"
-            )
-        ).count()
-        for agent in agents
-    }
-    sorted_agents = sorted(agent_loads.items(), key=lambda item: item[1])
-    return session.get(User, sorted_agents[0][0]) if sorted_agents else None
 
 # Rotas
 
 @app.post("/cadastrar")
-async def cadastrar(usuario: UsuarioCreate, db: Session = Depends(get_db)):
+async def cadastrar(usuario: UsuarioCreate, db: AsyncSession = Depends(get_async_session)):
     novo_usuario = Usuario.from_orm(usuario)
     db.add(novo_usuario)
-    db.commit()
-    db.refresh(novo_usuario)
+    await db.commit()
+    await db.refresh(novo_usuario)
     return f"Usuário {novo_usuario.nome} cadastrado com sucesso!"
 
 
 @app.post("/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), session: Session = Depends(get_session)):
-    user = session.exec(select(User).where(User.email == form_data.username)).first()
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), session: AsyncSession = Depends(get_async_session)):
+    user = (await session.exec(select(User).where(User.email == form_data.username))).first()
+    # bcrypt é caro: verifica fora do event loop
+    if not user or not await asyncio.to_thread(verify_password, form_data.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Credenciais inválidas")
     token = create_token({"sub": user.email})
     return {"access_token": token, "token_type": "bearer"}
 
 
 @app.get("/conversations")
-def get_conversations(session: Session = Depends(get_session), user: User = Depends(get_current_user)):
-    if user.role == "admin":
-        return session.exec(select(Conversation)).all()
-    return session.exec(select(Conversation).where(Conversation.assigned_to == user.id)).all()
+async def get_conversations(
+    request: Request,
+    response: Response,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    status: Optional[str] = None,
+    assigned_to: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_current_user),
+):
+    etag, not_modified = await conversations_etag(request, response, session, user)
+    if not_modified:
+        return not_modified_response(etag)
+
+    query = select(Conversation)
+    if user.role != "admin":
+        query = query.where(Conversation.assigned_to == user.id)
+    elif assigned_to is not None:
+        query = query.where(Conversation.assigned_to == assigned_to)
+    if status is not None:
+        query = query.where(Conversation.status == status)
+    return await fetch_page(session, query, Conversation.id, response, before_id, after_id, limit)
+
+
+@app.get("/conversations/changes")
+async def get_conversation_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_current_user),
+):
+    # Conversas alteradas depois da versão `since`, em ordem de versão.
+    # "listed": entra em /conversations; "mine": entra em /my-conversations.
+    # Conversas que saíram do alcance do usuário (ex.: reatribuídas) voltam só
+    # com id e versão, para o painel removê-las.
+    query = (
+        select(Conversation)
+        .where(Conversation.version > since)
+        .order_by(Conversation.version)
+        .limit(limit + 1)
+    )
+    rows = list((await session.exec(query)).all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    changes = []
+    for conversation in rows:
+        assigned = str(conversation.assigned_to) == str(user.id)
+        mine = str(conversation.created_by) == str(user.id) if user.role == "user" else assigned
+        listed = user.role == "admin" or assigned
+        if mine or listed:
+            changes.append({**jsonable_encoder(conversation), "mine": mine, "listed": listed})
+        else:
+            changes.append({"id": conversation.id, "version": conversation.version, "mine": False, "listed": False})
+
+    return {
+        "version": rows[-1].version if rows else since,
+        "changes": changes,
+        "has_more": has_more,
+    }
 
 
 
 @app.get("/agents/status")
-def get_agents_status(session: Session = Depends(get_session), user: User = Depends(get_current_user)):
+def get_agents_status(user: User = Depends(get_current_user)):
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
-    
-    agents = session.exec(select(User).where(User.role == "agent")).all()
-    status = []
-
-    for agent in agents:
-        count = session.exec(
-            select(Conversation).where(
-                Conversation.assigned_to == agent.id,
-                Conversation.status == "pending"
-            )
-        ).count()
-        status.append({
-            "agent_id": agent.id,
-            "name": agent.name,
-            "email": agent.email,
-            "pending_conversations": count
-        })
-    return status
+
+    return agent_loads.status()
 
 @app.post("/conversations/{conversation_id}/reply")
-async def reply(conversation_id: int, payload: MessagePayload, session: Session = Depends(get_session), user: User = Depends(get_current_user)):
-    conversation = session.get(Conversation, conversation_id)
+async def reply(conversation_id: int, payload: MessagePayload, session: AsyncSession = Depends(get_async_session), user: User = Depends(get_current_user)):
+    conversation = await session.get(Conversation, conversation_id)
 
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
     if str(conversation.assigned_to) != str(user.id):
         raise HTTPException(status_code=403, detail="Você não está atribuído a essa conversa")
 
-    message = Message(
+    message = await writer.add(Message(
         conversation_id=conversation_id,
         sender="agent",
         content=payload.message
-    )
-    session.add(message)
-    session.commit()
-
-    # envia via WhatsApp (remova se não usar Twilio)
-    try:
-        send_whatsapp_message(conversation.customer_number, payload.message)
-    except Exception as e:
-        print(f"Erro ao enviar mensagem via WhatsApp: {e}")
+    ))
 
+    # envia via WhatsApp (enfileirado, não bloqueia o event loop)
+    delivery = await outbound.enqueue(conversation.customer_number, payload.message)
 
-    await manager.broadcast({
+    await manager.send_conversation_event({
         "id": message.id,
         "conversation_id": conversation_id,
         "sender": "agent",
         "message": message.content,
         "timestamp": message.timestamp.isoformat()
-    })
-    return {"msg": "Mensagem enviada"}
+    }, conversation)
+    return {"msg": "Mensagem enviada", "delivery_id": delivery.id}
 
 
 @app.post("/conversations/{conversation_id}/end")
-def end_conversation(conversation_id: int, db: Session = Depends(get_session), user=Depends(get_current_user)):
-    conversation = db.get(Conversation, conversation_id)
+async def end_conversation(conversation_id: int, db: AsyncSession = Depends(get_async_session), user=Depends(get_current_user)):
+    conversation = await db.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="conversation not found")
     
@@ -414,41 +633,126 @@ def end_conversation(conversation_id: int, db: Session = Depends(get_session), u
     
     try:
         conversation.status = "closed"
-        db.commit()
+        await db.commit()
+        agent_loads.release(conversation.assigned_to)
+        manager.drop_conversation(conversation_id)
         return {"detail": "Conversation closed successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Error ending conversation")
 
 
 async def query_rasa_bot(message: str, sender_id: str):
-    try: 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://localhost:5005/webhooks/rest/webhook",
-                json={"sender": sender_id, "message": message}
-            )
-            response.raise_for_status()
-            return response.json()
-    except Exception as e:
-        print("Erro ao consultar rasa:", e)
+    hit, cached = bot_cache.get("rasa", message)
+    if hit:
+        return cached
+    start = time.perf_counter()
+    responses = await rasa_client.post_json(
+        "/webhooks/rest/webhook",
+        {"sender": sender_id, "message": message}
+    )
+    elapsed = time.perf_counter() - start
+    WEBHOOK_STAGE_SECONDS.observe(elapsed, stage="rasa")
+    if responses is not None:
+        bot_cache.put("rasa", message, responses, elapsed)
+    return responses
+
+async def query_ollama_bot(message: str, sender_id: Optional[str] = None, model: str = OLLAMA_MODEL):
+    hit, cached = bot_cache.get(f"ollama:{model}", message)
+    if hit:
+        return cached
+    start = time.perf_counter()
+    if OLLAMA_STREAM:
+        reply = await stream_ollama_reply(message, sender_id, model)
+    else:
+        data = await ollama_client.post_json(
+            "/api/generate",
+            {"model": model, "prompt": message, "stream": False}
+        )
+        reply = data.get("response", "").strip() if data else None
+    elapsed = time.perf_counter() - start
+    WEBHOOK_STAGE_SECONDS.observe(elapsed, stage="ollama")
+    if reply is None:
         return None
-
-async def query_ollama_bot(message: str, model: str = "mistral"):
+    bot_cache.put(f"ollama:{model}", message, reply, elapsed)
+    return reply
+
+
+async def stream_ollama_reply(message: str, sender_id: Optional[str], model: str):
+    # Consome os tokens do Ollama conforme chegam, mostra a resposta se
+    # formando para os supervisores e para assim que o cliente pede atendente
+    parts = []
+    tail = ""
+    finished = False
+    handoff = False
+    pushed = False
+    last_push = 0.0
+    key = f"bot_partial:{sender_id}"
+
+    async def push(done: bool, cancelled: bool = False):
+        nonlocal pushed
+        pushed = True
+        await manager.send_to_role({
+            "type": "bot_partial",
+            "sender": "bot",
+            "source": "ollama",
+            "message": "".join(parts),
+            "done": done,
+            "cancelled": cancelled,
+            "handoff": handoff,
+            "conversation_id": None,
+            "customer_number": sender_id,
+        }, "admin", key=key)
+
+    stream = ollama_client.stream_json_lines(
+        "/api/generate",
+        {"model": model, "prompt": message, "stream": True}
+    )
+    cancelled = False
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "http://localhost:11434/api/generate",
-                json={"model": model, "prompt": message, "stream": False}
-            )
-            response.raise_for_status()
-            return response.json().get("response", "").strip()
-    except Exception as e:
-        print("Erro ao consultar Ollama:", e)
+        async for chunk in stream:
+            token = chunk.get("response", "")
+            if token:
+                parts.append(token)
+                # Janela do fim do texto: a frase pode vir quebrada em vários tokens
+                tail = (tail + token.lower())[-(len(OLLAMA_HANDOFF) + len(token)):]
+                if OLLAMA_HANDOFF in tail:
+                    handoff = True
+                    break
+            if chunk.get("done"):
+                finished = True
+                break
+            now = time.perf_counter()
+            if now - last_push >= OLLAMA_STREAM_PUSH_INTERVAL:
+                last_push = now
+                await push(done=False)
+    except asyncio.CancelledError:
+        # O Rasa respondeu primeiro
+        cancelled = True
+        raise
+    finally:
+        await stream.aclose()
+        if pushed and (cancelled or not (finished or handoff)):
+            # A resposta parcial não vai ser enviada: avisa para tirar a prévia
+            # da tela (se nenhuma chegou a ser mostrada, não há o que tirar)
+            await push(done=True, cancelled=True)
+
+    if not (finished or handoff):
         return None
-  
+    await push(done=True)
+    return "".join(parts).strip()
+
+
+bot_pipeline = BotPipeline(
+    query_rasa_bot,
+    query_ollama_bot,
+    budget=float(os.getenv("BOT_LATENCY_BUDGET_MS", "8000")) / 1000,
+    speculative=os.getenv("BOT_SPECULATIVE_OLLAMA", "1") == "1",
+)
+
 @app.post("/webhook/whatsapp")
-async def whatsapp_webhook(request: Request, session: Session = Depends(get_session)):
+async def whatsapp_webhook(request: Request):
+    parse_start = time.perf_counter()
     try:
         # Tentar receber dados como JSON primeiro
         try:
@@ -456,96 +760,165 @@ async def whatsapp_webhook(request: Request, session: Session = Depends(get_sess
             from_number = payload.get("from", "").replace("whatsapp:", "")
             message_body = payload.get("message", "")
             profile_name = payload.get("name", "Cliente")
+            message_sid = payload.get("MessageSid") or payload.get("message_sid")
         except:
             # Se falhar, tentar como form data (formato padrão do Twilio)
             form_data = await request.form()
             from_number = form_data.get("From", "").replace("whatsapp:", "")
             message_body = form_data.get("Body", "")
             profile_name = form_data.get("ProfileName", "Cliente")
+            message_sid = form_data.get("MessageSid")
 
+        WEBHOOK_STAGE_SECONDS.observe(time.perf_counter() - parse_start, stage="parse")
         print(f"Mensagem recebida de {from_number}: {message_body}")
 
         if not from_number or not message_body:
             raise HTTPException(status_code=400, detail="Dados incompletos")
 
+        # Só grava o evento e responde; o processamento é feito pela caixa de
+        # entrada em segundo plano. Sem MessageSid (testes locais) não há
+        # como deduplicar, então cada chamada vira um evento novo.
+        try:
+            with WEBHOOK_STAGE_SECONDS.time(stage="inbox"):
+                event, created = await inbox.accept(
+                    message_sid or f"local-{uuid.uuid4().hex}", from_number, message_body, profile_name
+                )
+        except Exception as e:
+            # Evento não gravado: sem 2xx o Twilio reenvia a mensagem depois
+            WEBHOOK_EVENTS.inc(result="erro")
+            print(f"Erro ao gravar evento do webhook: {e}")
+            return JSONResponse(status_code=503, content={"status": "erro", "message": "Evento não gravado"})
+        if not created:
+            WEBHOOK_EVENTS.inc(result="duplicado")
+            return {"status": "duplicado", "event_id": event.id}
+        WEBHOOK_EVENTS.inc(result="recebido")
+        return {"status": "recebido", "event_id": event.id}
+
+    except Exception as e:
+        WEBHOOK_EVENTS.inc(result="erro")
+        print(f"Erro no webhook WhatsApp: {e}")
+        return {"status": "erro", "message": str(e)}
+
+
+async def process_inbound_message(event: InboundEvent):
+    # Pode rodar mais de uma vez para o mesmo evento (retentativas da caixa
+    # de entrada): o que já foi feito fica gravado no evento (message_id,
+    # replied_at) e não se repete, para não duplicar mensagens nem respostas
+    from_number = event.from_number
+    message_body = event.body
+    profile_name = event.profile_name or "Cliente"
+
+    if event.message_id is None:
+        if event.replied_at is not None:
+            # Um bot já respondeu numa tentativa anterior
+            return
+
         # PRIMEIRA ETAPA: Tentar resposta automática com bots
-        
-        # Consultar Rasa
-        rasa_responses = await query_rasa_bot(message_body, from_number)
-        if rasa_responses:
-            for rasa_resp in rasa_responses:
-                text = rasa_resp.get("text")
-                if text and "encaminhar_para_humano" not in text.lower():
-                    # Resposta automática do Rasa - envia direto via WhatsApp
-                    send_whatsapp_message(from_number, text)
-                    
-                    # Notifica interface (opcional, para histórico)
-                    await manager.send_personal_message({
-                        "sender": "bot",
-                        "message": text,
-                        "conversation_id": None,
-                        "customer_number": from_number
-                    }, from_number)
-                    
-                    return {"status": "respondido pelo Rasa"}
-
-        # Consultar Ollama
-        ollama_reply = await query_ollama_bot(message_body)
-        if ollama_reply and "falar com atendente" not in ollama_reply.lower():
-            # Resposta automática do Ollama - envia direto via WhatsApp
-            send_whatsapp_message(from_number, ollama_reply)
-            
-            # Notifica interface (opcional, para histórico)
-            await manager.send_personal_message({
-                "sender": "bot",
-                "message": ollama_reply,
-                "conversation_id": None,
-                "customer_number": from_number
-            }, from_number)
-            
-            return {"status": "respondido pelo Ollama"}
-
-        # SEGUNDA ETAPA: Se bots não responderam, encaminhar para agente
-        
+        # (Rasa e Ollama em paralelo, limitados pelo orçamento de latência)
+        with WEBHOOK_STAGE_SECONDS.time(stage="bots"):
+            decision = await bot_pipeline.run(message_body, from_number)
+        if decision.source:
+            # Resposta automática - enfileira o envio via WhatsApp
+            with WEBHOOK_STAGE_SECONDS.time(stage="twilio"):
+                await outbound.enqueue(from_number, decision.text)
+            await inbox.record(event.id, replied_at=datetime.now(timezone.utc))
+
+            # Notifica supervisores (opcional, para histórico)
+            with WEBHOOK_STAGE_SECONDS.time(stage="broadcast"):
+                await manager.send_to_role({
+                    "sender": "bot",
+                    "message": decision.text,
+                    "conversation_id": None,
+                    "customer_number": from_number
+                }, "admin")
+            return
+
+    # SEGUNDA ETAPA: Se bots não responderam, encaminhar para agente
+    db_start = time.perf_counter()
+    if event.message_id is not None:
+        # Mensagem já gravada numa tentativa anterior
+        async with async_session_maker() as session:
+            msg = await session.get(Message, event.message_id)
+            conversation = await session.get(Conversation, event.conversation_id)
+            first_id = (await session.exec(
+                select(func.min(Message.id)).where(Message.conversation_id == conversation.id)
+            )).one()
+        created = first_id == msg.id
+    else:
         # Verificar se já existe conversa ativa
-        conversation = session.exec(
-            select(Conversation).where(
-                Conversation.customer_number == from_number,
-                Conversation.status == "pending"
+        async with async_session_maker() as session:
+            conversation = (await session.exec(
+                select(Conversation).where(
+                    Conversation.customer_number == from_number,
+                    Conversation.status == "pending"
+                )
+            )).first()
+
+        # A mensagem e o registro no evento vão na mesma transação
+        async def mark_event(session, conversation, msg):
+            await session.flush()
+            await session.exec(
+                update(InboundEvent)
+                .where(InboundEvent.id == event.id)
+                .values(conversation_id=conversation.id, message_id=msg.id)
             )
-        ).first()
-
-        # Se não existe conversa ativa, criar uma nova
-        if not conversation:
-            agent = get_least_busy_agent(session)
-            conversation = Conversation(
-                customer_number=from_number,
-                name=profile_name,
-                assigned_to=agent.id if agent else None,
-                created_by=agent.id if agent else None,
-                status="pending",
-            )
-            session.add(conversation)
-            session.commit()
-            session.refresh(conversation)
-
-            # Enviar mensagem de boas-vindas apenas para conversas novas
-            try:
-                send_whatsapp_message(from_number, f"Olá {profile_name}, um operador entrará em contato com você em breve.")
-            except Exception as e:
-                print(f"Erro ao enviar mensagem de boas-vindas: {e}")
 
-        # Salvar mensagem do cliente no banco
-        msg = Message(
-            conversation_id=conversation.id,
-            sender="customer",
-            content=message_body
-        )
-        session.add(msg)
-        session.commit()
+        created = conversation is None
+        if conversation:
+            conversation_id = conversation.id
+
+            async def save(session):
+                # Salvar mensagem do cliente no banco
+                msg = Message(
+                    conversation_id=conversation_id,
+                    sender="customer",
+                    content=message_body
+                )
+                session.add(msg)
+                await mark_event(session, conversation, msg)
+                return msg
+
+            msg = await writer.run(save)
+        else:
+            # Se não existe conversa ativa, criar uma nova junto com a mensagem
+            agent_id = agent_loads.acquire()
+
+            async def create(session):
+                conversation = Conversation(
+                    customer_number=from_number,
+                    name=profile_name,
+                    assigned_to=agent_id,
+                    created_by=agent_id,
+                    status="pending",
+                )
+                session.add(conversation)
+                await session.flush()
+                msg = Message(
+                    conversation_id=conversation.id,
+                    sender="customer",
+                    content=message_body
+                )
+                session.add(msg)
+                await mark_event(session, conversation, msg)
+                return conversation, msg
 
-        # Notificar agentes via WebSocket
-        await manager.broadcast({
+            try:
+                conversation, msg = await writer.run(create)
+            except Exception:
+                agent_loads.release(agent_id)
+                raise
+    WEBHOOK_STAGE_SECONDS.observe(time.perf_counter() - db_start, stage="db")
+
+    # Enviar mensagem de boas-vindas apenas para conversas novas
+    if created and event.replied_at is None:
+        welcome = f"Olá {profile_name}, um operador entrará em contato com você em breve."
+        with WEBHOOK_STAGE_SECONDS.time(stage="twilio"):
+            await outbound.enqueue(from_number, welcome)
+        await inbox.record(event.id, replied_at=datetime.now(timezone.utc))
+
+    # Notificar o agente atribuído, admins e inscritos via WebSocket
+    with WEBHOOK_STAGE_SECONDS.time(stage="broadcast"):
+        await manager.send_conversation_event({
             "id": msg.id,
             "conversation_id": conversation.id,
             "sender": "customer",
@@ -553,22 +926,209 @@ async def whatsapp_webhook(request: Request, session: Session = Depends(get_sess
             "timestamp": msg.timestamp.isoformat(),
             "customer_name": profile_name,
             "customer_number": from_number
-        })
+        }, conversation)
 
-        return {"status": "encaminhado para operador"}
 
-    except Exception as e:
-        print(f"Erro no webhook WhatsApp: {e}")
-        return {"status": "erro", "message": str(e)}
+inbox = WebhookInbox(
+    async_session_maker,
+    process_inbound_message,
+    workers=int(os.getenv("INBOX_WORKERS", "32")),
+    max_attempts=int(os.getenv("INBOX_MAX_ATTEMPTS", "5")),
+    retry_delay=float(os.getenv("INBOX_RETRY_DELAY_SECONDS", "2")),
+    retention=float(os.getenv("INBOX_RETENTION_HOURS", "72")) * 3600,
+    lease=float(os.getenv("INBOX_LEASE_SECONDS", "60")),
+)
+
+
+@app.on_event("startup")
+async def start_write_batcher():
+    writer.start()
+
+
+@app.on_event("startup")
+async def start_inbox():
+    await inbox.start()
+
+
+@app.on_event("startup")
+async def start_archiver():
+    interval = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+    if interval > 0:
+        asyncio.create_task(archive_periodically(interval))
+
+
+async def archive_periodically(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await asyncio.to_thread(archive.run)
+            archived = report.get("archived")
+            if archived and archived["conversations"]:
+                print(f"Arquivadas {archived['conversations']} conversas ({archived['messages']} mensagens)")
+        except Exception as e:
+            print("Erro ao arquivar conversas:", e)
+
+
+@app.on_event("shutdown")
+async def stop_inbox():
+    await inbox.stop()
+    await writer.stop()
+
+
+# Métricas dos componentes, lidas dos stats() de cada um na hora da coleta
+REGISTRY.callback("websocket_connections", "WebSockets conectados neste processo", lambda: len(manager.connections))
+REGISTRY.callback("websocket_send_queue_depth", "Eventos aguardando envio em todas as filas de WebSocket", lambda: manager.stats()["queue_depth"])
+REGISTRY.callback("websocket_max_send_queue_depth", "Maior fila de envio de um WebSocket", lambda: manager.stats()["max_queue_depth"])
+REGISTRY.callback("websocket_dropped_events_total", "Eventos descartados por fila cheia", lambda: manager.dropped, type="counter")
+REGISTRY.callback("websocket_coalesced_events_total", "Eventos substituídos por um mais recente", lambda: manager.coalesced, type="counter")
+REGISTRY.callback("websocket_evictions_total", "WebSockets desconectados por lentidão", lambda: manager.evictions, type="counter")
+REGISTRY.callback("websocket_replayed_events_total", "Eventos reenviados a clientes que reconectaram", lambda: manager.replayed, type="counter")
+REGISTRY.callback("websocket_reaped_total", "WebSockets desconectados por não responder ao ping", lambda: manager.reaped, type="counter")
+REGISTRY.callback("websocket_queued_bytes", "Bytes aguardando envio nas filas de WebSocket", lambda: manager.stats()["queued_bytes"])
+REGISTRY.callback("websocket_events_sent_total", "Eventos enviados pelos WebSockets", lambda: manager.events_sent, type="counter")
+REGISTRY.callback("websocket_frames_sent_total", "Frames enviados pelos WebSockets (vários eventos por frame com WS_BATCH_MS)", lambda: manager.frames_sent, type="counter")
+REGISTRY.callback("websocket_resyncs_total", "Reconexões que precisaram recarregar tudo", lambda: manager.resyncs, type="counter")
+REGISTRY.callback("bot_cache_hits_total", "Acertos do cache de respostas dos bots", lambda: bot_cache.hits, type="counter")
+REGISTRY.callback("bot_cache_misses_total", "Faltas do cache de respostas dos bots", lambda: bot_cache.misses, type="counter")
+REGISTRY.callback("bot_cache_entries", "Respostas no cache dos bots", lambda: len(bot_cache.entries))
+REGISTRY.callback("bot_cache_saved_seconds_total", "Tempo de geração economizado pelo cache", lambda: bot_cache.saved_seconds, type="counter")
+REGISTRY.callback("auth_cache_hits_total", "Acertos do cache de autenticação", lambda: auth_cache.hits, type="counter")
+REGISTRY.callback("auth_cache_misses_total", "Faltas do cache de autenticação", lambda: auth_cache.misses, type="counter")
+REGISTRY.callback(
+    "bot_pipeline_outcomes_total", "Decisões do pipeline de bots por motivo",
+    lambda: [({"reason": reason}, count) for reason, count in bot_pipeline.outcomes.items()], type="counter",
+)
+REGISTRY.callback(
+    "bot_circuit_open", "1 se o circuit breaker do bot não está fechado",
+    lambda: [({"bot": c.name}, int(c.breaker.state != "closed")) for c in (rasa_client, ollama_client)],
+)
+REGISTRY.callback("inbox_queue_depth", "Eventos do webhook aguardando processamento", lambda: inbox.scheduler.depth())
+REGISTRY.callback(
+    "inbox_head_of_line_seconds", "Idade do item mais antigo em cada shard da caixa de entrada",
+    lambda: [({"shard": str(s["shard"])}, s["head_of_line_ms"] / 1000) for s in inbox.scheduler.stats()["shards"]],
+)
+REGISTRY.callback("outbound_queue_depth", "Mensagens WhatsApp aguardando envio", lambda: outbound.queue.qsize())
+REGISTRY.callback("archived_conversations_total", "Conversas movidas para o arquivo neste processo", lambda: archive.archived_conversations, type="counter")
+REGISTRY.callback("archive_reads_total", "Leituras de conversas arquivadas", lambda: archive.reads, type="counter")
+REGISTRY.callback("write_batches_total", "Commits em lote do writer", lambda: writer.batches, type="counter")
+REGISTRY.callback("write_operations_total", "Operações gravadas pelo writer em lote", lambda: writer.operations, type="counter")
+
+
+@app.get("/metrics")
+def metrics(request: Request):
+    # Sem login para o Prometheus; METRICS_TOKEN exige "Authorization: Bearer <token>"
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and request.headers.get("authorization") != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/inbox")
+def get_inbox_stats(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    return inbox.stats()
+
+
+@app.get("/admin/writes")
+def get_write_stats(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    return writer.stats()
+
+
+@app.get("/admin/archive")
+def get_archive_stats(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    return {**archive.stats(), "hot_db": database_size(engine)}
+
+
+@app.post("/admin/archive/run")
+async def run_archive(vacuum: bool = False, user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    # Relatório com o tamanho do banco quente antes e depois
+    return await asyncio.to_thread(archive.run, None, vacuum)
+
+
+@app.get("/admin/queries")
+def get_query_profile(limit: int = Query(50, ge=1, le=500), order_by: str = "total", user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    return query_profiler.report(limit=limit, order_by=order_by)
+
+
+@app.post("/admin/queries/profiler")
+def configure_query_profiler(
+    enabled: Optional[bool] = None,
+    slow_ms: Optional[float] = Query(None, ge=0),
+    explain: Optional[bool] = None,
+    user: User = Depends(get_current_user),
+):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    query_profiler.configure(
+        enabled=enabled,
+        slow_threshold=slow_ms / 1000 if slow_ms is not None else None,
+        explain=explain,
+    )
+    return {"enabled": query_profiler.enabled, "slow_threshold_ms": query_profiler.slow_threshold * 1000, "explain": query_profiler.explain}
+
+
+@app.delete("/admin/queries")
+def reset_query_profile(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    query_profiler.reset()
+    return {"msg": "Estatísticas de consultas zeradas"}
+
+
+@app.get("/admin/auth-cache")
+def get_auth_cache_stats(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    return auth_cache.stats()
+
+
+@app.get("/admin/bots")
+def get_bot_stats(user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    return {
+        "clients": [rasa_client.stats(), ollama_client.stats()],
+        "pipeline": bot_pipeline.stats(),
+        "cache": bot_cache.stats(),
+    }
+
+
+@app.get("/admin/websockets")
+def get_websocket_stats(detail: bool = False, user: User = Depends(get_current_user)):
+    if user.role != "admin":
+        raise HTTPException(status_code=403, detail="Apenas admins podem acessar")
+    # detail=true inclui idade, inatividade e memória de cada conexão
+    return manager.stats(detail)
+
+
+@app.get("/deliveries/{delivery_id}")
+def get_delivery(delivery_id: str, user: User = Depends(get_current_user)):
+    delivery = outbound.get(delivery_id)
+    if not delivery:
+        raise HTTPException(status_code=404, detail="Envio não encontrado")
+    return delivery.as_dict()
+
 
 @app.post("/conversations/{conversation_id}/assign")
-def assign_conversation(conversation_id: int, user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    conversation = session.get(Conversation, conversation_id)
+async def assign_conversation(conversation_id: int, user: User = Depends(get_current_user), session: AsyncSession = Depends(get_async_session)):
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
+    previous = conversation.assigned_to
     conversation.assigned_to = user.id
     session.add(conversation)
-    session.commit()
+    await session.commit()
+    if conversation.status == "pending":
+        agent_loads.move(previous, user.id)
     return {"msg": "Conversa atribuida ao operador"}
 
 
@@ -576,97 +1136,138 @@ def assign_conversation(conversation_id: int, user: User = Depends(get_current_u
 
 
 @app.post("/fake-conversation")
-def create_fake(session: Session = Depends(get_session)):
+async def create_fake(session: AsyncSession = Depends(get_async_session)):
     new = Conversation(customer_number="+55119999999", status="pending")
     session.add(new)
-    session.commit()
-    session.refresh(new)
+    await session.commit()
+    await session.refresh(new)
     return {"id": new.id}
 
 
 @app.post("/conversations")
-def create_conversation(data: ConversationCreate, user=Depends(get_current_user), session: Session = Depends(get_session)):
+async def create_conversation(data: ConversationCreate, user=Depends(get_current_user)):
     #agent = get_least_busy_agent(session)
 
 
-    conversation = Conversation(
-        customer_number=data.customer_number,
-        status="pending",
-        #assigned_to=None,
-        created_by=user.id
-    )
+    async def create(session):
+        conversation = Conversation(
+            customer_number=data.customer_number,
+            status="pending",
+            #assigned_to=None,
+            created_by=user.id
+        )
+        session.add(conversation)
+        await session.flush()
 
-    session.add(conversation)
-    session.commit()
-    session.refresh(conversation)
-
-    message = Message(
-        conversation_id=conversation.id,
-        sender="customer",
-        content=data.initial_message,
-        timestamp=datetime.utcnow()
-    )
-    session.add(message)
-    session.commit()
+        session.add(Message(
+            conversation_id=conversation.id,
+            sender="customer",
+            content=data.initial_message,
+            timestamp=datetime.utcnow()
+        ))
+        return conversation
+
+    # Conversa e mensagem inicial no mesmo commit
+    conversation = await writer.run(create)
 
     return {"id": conversation.id, "message": "Conversa criada"}
 
 @app.get("/conversations/{conversation_id}/messages")
-def get_messages(conversation_id: int, session: Session = Depends(get_session), user: User = Depends(get_current_user)):
-    conversation = session.get(Conversation, conversation_id)
+async def get_messages(
+    conversation_id: int,
+    response: Response,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_current_user),
+):
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversa não encontrada")
     
-    if user.role != "admin" and conversation.assigned_to != user.id and conversation.created_by != user.id:
+    if not can_access_conversation(user, conversation):
         raise HTTPException(status_code=403, detail="Acesso negado")
-    
-    messages = session.exec(
-        select(Message).where(Message.conversation_id == conversation_id)
-    ).all()
-    return messages
+
+    # Quem abre a conversa passa a receber os eventos dela pelo WebSocket
+    manager.subscribe(user.id, conversation_id)
+
+    query = select(Message).where(Message.conversation_id == conversation_id)
+    if conversation.status == "closed":
+        # Conversa arquivada: histórico vem do segmento, mais o que ainda
+        # estiver no banco quente
+        archived = await archive.load_messages(session, conversation_id)
+        if archived is not None:
+            hot = jsonable_encoder((await session.exec(query.order_by(Message.id))).all())
+            return page_from_list(archived + hot, response, before_id, after_id, limit)
+    return await fetch_page(session, query, Message.id, response, before_id, after_id, limit)
 
 @app.get("/my-conversations")
-def get_my_conversations(session: Session = Depends(get_session), user: User = Depends(get_current_user)):
+async def get_my_conversations(
+    request: Request,
+    response: Response,
+    before_id: Optional[int] = None,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    status: Optional[str] = None,
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_current_user),
+):
+    etag, not_modified = await conversations_etag(request, response, session, user)
+    if not_modified:
+        return not_modified_response(etag)
+
     if user.role == "user":
-        return session.exec(
-            select(Conversation).where(Conversation.created_by == user.id)
-        ).all()
+        query = select(Conversation).where(Conversation.created_by == user.id)
     else:
-        return session.exec(
-            select(Conversation).where(Conversation.assigned_to == user.id)
-        ).all()
+        query = select(Conversation).where(Conversation.assigned_to == user.id)
+    if status is not None:
+        query = query.where(Conversation.status == status)
+    return await fetch_page(session, query, Conversation.id, response, before_id, after_id, limit)
+
+@app.get("/search")
+async def search(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_current_user),
+):
+    # Ordenado por relevância: paginação por offset, não por id
+    match = build_match_query(q)
+    if not match:
+        response.headers["X-Has-More"] = "false"
+        return []
+    try:
+        results, has_more = await search_messages(
+            session, match, None if user.role == "admin" else user.id, limit, offset
+        )
+        # Mensagens de conversas arquivadas: texto vem do segmento
+        await fill_archived_results(session, results, archive.load_messages, q)
+    except OperationalError as e:
+        print("Erro na busca:", e)
+        raise HTTPException(status_code=503, detail="Busca indisponível")
+    response.headers["X-Has-More"] = "true" if has_more else "false"
+    return results
+
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
+async def websocket_endpoint(websocket: WebSocket, token: str = Query(...),
+                             last_seq: Optional[int] = None, epoch: Optional[str] = None):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if not email:
-            await websocket.close(code=1008)
-            return
-            #raise HTTPException(status_code=401, detail="Token inválido")
-
-        with Session(engine) as session:
-            user = session.exec(select(User).where(User.email == email)).first()
-            if not user:
-                #await websocket.send_json({"error": "Usuário inválido"})
-                await websocket.close(code=1008)
-                return
-    except JWTError:
+        user = await authenticate_token(token)
+    except HTTPException:
        # await websocket.send_json({"error": "Token inválido"})
         await websocket.close(code=1008)
         return
 
    # await websocket.accept()
-    await manager.connect(websocket)
-    try:
-        while True:
-           # data = await websocket.receive_json()
-            #await manager.broadcast(data)
-            await asyncio.sleep(1000)
-    except WebSocketDisconnect:
-        manager.disconnect(websocket)
-       
+    # Reconexão: last_seq/epoch do último evento recebido
+    await manager.connect(websocket, user.id, user.role, last_seq, epoch)
+    # Lê até o cliente fechar (ou ser desconectado por inatividade)
+    await manager.receive_loop(websocket)
+
 
 #@app.websocket("/ws")
 #async def websocket_endpoint(websocket: WebSocket):
@@ -0,0 +1,234 @@
+# Métricas no formato de texto do Prometheus
+#
+# Implementação mínima, sem dependências: contadores, histogramas e
+# métricas calculadas na hora da coleta (a partir dos stats() já existentes
+# em cada componente). Tudo registrado em REGISTRY e exposto em /metrics.
+#
+# Uso nos pontos quentes:
+#     with WEBHOOK_STAGE_SECONDS.time(stage="rasa"):
+#         ...
+#     DB_QUERY_SECONDS.observe(elapsed, operation="select")
+
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name + _format_labels(self.label_names, key), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [contagem por bucket..., soma, total]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[index] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, state in self.values.items():
+            cumulative = 0
+            for index, bound in enumerate(self.buckets):
+                cumulative += state[index]
+                le = 'le="' + ("+Inf" if math.isinf(bound) else repr(bound)) + '"'
+                yield self.name + "_bucket" + _format_labels(self.label_names, key, le), cumulative
+            yield self.name + "_sum" + _format_labels(self.label_names, key), state[-2]
+            yield self.name + "_count" + _format_labels(self.label_names, key), state[-1]
+
+
+class CallbackMetric:
+    """Valor lido na coleta: fn() devolve um número ou [(labels dict, número)]."""
+
+    def __init__(self, name: str, help: str, type: str, fn: Callable):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.fn = fn
+
+    def samples(self):
+        result = self.fn()
+        if isinstance(result, (int, float)):
+            yield self.name, result
+            return
+        for labels, value in result:
+            names = tuple(labels)
+            yield self.name + _format_labels(names, tuple(labels[name] for name in names)), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, fn: Callable, type: str = "gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, type, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                print(f"Erro ao coletar métrica {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for sample, value in samples:
+                lines.append(f"{sample} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Latência das requisições HTTP por rota", ("method", "route", "status")
+)
+HTTP_REQUEST_DB_QUERIES = REGISTRY.histogram(
+    "http_request_db_queries", "Consultas ao banco por requisição", ("route",),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+WEBHOOK_STAGE_SECONDS = REGISTRY.histogram(
+    "webhook_stage_duration_seconds", "Tempo de cada etapa do webhook do WhatsApp", ("stage",)
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds", "Latência das consultas ao banco", ("operation",)
+)
+WEBHOOK_EVENTS = REGISTRY.counter(
+    "webhook_events_total", "Eventos recebidos pelo webhook do WhatsApp", ("result",)
+)
+WHATSAPP_SEND_SECONDS = REGISTRY.histogram(
+    "whatsapp_send_duration_seconds", "Tempo de cada envio ao transporte WhatsApp", ("result",)
+)
+
+# Consultas feitas dentro da requisição atual (o middleware cria a lista).
+# As escritas do GroupCommitWriter rodam na task dele: o writer guarda a
+# lista de quem pediu a operação e a reinstala com record_queries_into
+_request_queries: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("request_queries", default=None)
+
+
+def start_request_tracking():
+    return _request_queries.set([])
+
+
+def finish_request_tracking(token) -> list:
+    queries = _request_queries.get() or []
+    _request_queries.reset(token)
+    return queries
+
+
+def request_queries() -> Optional[list]:
+    return _request_queries.get()
+
+
+@contextmanager
+def record_queries_into(queries: Optional[list]):
+    """Atribui as consultas feitas no bloco à lista de outra requisição."""
+    token = _request_queries.set(queries)
+    try:
+        yield
+    finally:
+        _request_queries.reset(token)
+
+
+def observe_query(statement: str, seconds: float):
+    operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+    DB_QUERY_SECONDS.observe(seconds, operation=operation)
+    queries = _request_queries.get()
+    if queries is not None:
+        queries.append(seconds)
+
+
+def instrument_engine(engine, profiler=None):
+    """Mede todas as consultas de uma engine síncrona (ou engine.sync_engine).
+
+    Com um QueryProfiler ligado, cada consulta também é passada para ele.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if starts:
+            seconds = time.perf_counter() - starts.pop()
+            observe_query(statement, seconds)
+            if profiler is not None and profiler.enabled:
+                profiler.observe(conn, statement, parameters, seconds, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def failed(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,170 @@
+# Migrações de esquema versionadas
+#
+# Cada migração tem um número de versão e roda uma única vez; as versões
+# aplicadas ficam na tabela schema_migrations. Com vários workers subindo ao
+# mesmo tempo, cada migração roda numa transação que pega a trava de escrita
+# do SQLite (BEGIN IMMEDIATE) antes de conferir a versão: o segundo worker
+# espera o primeiro terminar (até o busy_timeout) e então vê a versão já
+# aplicada. Em outros bancos não há essa trava; lá as migrações devem rodar
+# de um processo só.
+
+from datetime import datetime, timezone
+
+from sqlalchemy import inspect, text
+
+from backend.search import create_search_index, rebuild_search_index, search_index_exists
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return fn
+    return register
+
+
+def _columns(conn, table: str):
+    return {col["name"] for col in inspect(conn).get_columns(table)}
+
+
+@migration(1, "coluna conversation.name")
+def add_conversation_name(conn):
+    # Substitui o antigo hook verificar_e_adicionar_coluna_name
+    if "name" not in _columns(conn, "conversation"):
+        conn.execute(text("ALTER TABLE conversation ADD COLUMN name VARCHAR"))
+
+
+@migration(2, "índices das consultas mais usadas")
+def add_hot_path_indexes(conn):
+    statements = [
+        # get_messages: mensagens de uma conversa em ordem de id
+        "CREATE INDEX IF NOT EXISTS ix_message_conversation_id_id ON message (conversation_id, id)",
+        # whatsapp_webhook: conversa pendente do cliente
+        "CREATE INDEX IF NOT EXISTS ix_conversation_customer_status ON conversation (customer_number, status)",
+        # carga dos agentes e /conversations, /my-conversations de agentes
+        "CREATE INDEX IF NOT EXISTS ix_conversation_assigned_status ON conversation (assigned_to, status)",
+        # /my-conversations de usuários
+        "CREATE INDEX IF NOT EXISTS ix_conversation_created_by ON conversation (created_by)",
+        # get_current_user, login e websocket_endpoint
+        "CREATE INDEX IF NOT EXISTS ix_user_email ON user (email)",
+        "CREATE INDEX IF NOT EXISTS ix_user_role ON user (role)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+    conn.execute(text("ANALYZE"))
+
+
+@migration(3, "índice de status para listagens paginadas")
+def add_conversation_status_index(conn):
+    # O rowid vai junto no índice, então filtra por status já em ordem de id
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_status ON conversation (status)"))
+
+
+@migration(4, "índice de status da caixa de entrada do webhook")
+def add_inbound_event_status_index(conn):
+    # Replay no startup e limpeza de eventos processados
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_inboundevent_status ON inboundevent (status, id)"
+    ))
+
+
+@migration(5, "versão das conversas para sincronização incremental")
+def add_conversation_version(conn):
+    if "version" not in _columns(conn, "conversation"):
+        conn.execute(text("ALTER TABLE conversation ADD COLUMN version INTEGER NOT NULL DEFAULT 0"))
+        # Conversas existentes entram no feed na ordem de criação
+        conn.execute(text("UPDATE conversation SET version = id"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_conversation_version ON conversation (version)"))
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS change_sequence (name VARCHAR PRIMARY KEY, value INTEGER NOT NULL)"
+    ))
+    conn.execute(text(
+        "INSERT OR IGNORE INTO change_sequence (name, value) "
+        "SELECT 'conversation', COALESCE(MAX(version), 0) FROM conversation"
+    ))
+
+
+@migration(6, "índice de busca textual das mensagens (FTS5)")
+def add_message_search_index(conn):
+    if conn.dialect.name != "sqlite":
+        print("Busca textual disponível só no SQLite (FTS5); índice não criado")
+        return
+    # Já reconstruído offline (python -m backend.search --rebuild): só garante as triggers
+    existed = search_index_exists(conn)
+    create_search_index(conn)
+    if not existed:
+        rebuild_search_index(conn)
+
+
+@migration(7, "dono e lease dos eventos da caixa de entrada")
+def add_inbound_event_lease(conn):
+    columns = _columns(conn, "inboundevent")
+    if "owner" not in columns:
+        conn.execute(text("ALTER TABLE inboundevent ADD COLUMN owner VARCHAR"))
+    if "lease_until" not in columns:
+        conn.execute(text("ALTER TABLE inboundevent ADD COLUMN lease_until DATETIME"))
+
+
+@migration(8, "mensagens arquivadas continuam no índice de busca")
+def keep_archived_messages_searchable(conn):
+    if conn.dialect.name != "sqlite" or not search_index_exists(conn):
+        return
+    # A trigger de remoção passa a ignorar as mensagens arquivadas
+    conn.execute(text("DROP TRIGGER IF EXISTS message_fts_delete"))
+    create_search_index(conn)
+    if "archivedconversation" in inspect(conn).get_table_names():
+        archived = conn.execute(text("SELECT COUNT(*) FROM archivedconversation")).scalar()
+        if archived:
+            print(f"{archived} conversas já arquivadas ficaram fora da busca; "
+                  "rode python -m backend.search --rebuild para reindexá-las")
+
+
+@migration(9, "progresso do processamento dos eventos da caixa de entrada")
+def add_inbound_event_progress(conn):
+    columns = _columns(conn, "inboundevent")
+    for name, type_ in (("conversation_id", "INTEGER"), ("message_id", "INTEGER"), ("replied_at", "DATETIME")):
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE inboundevent ADD COLUMN {name} {type_}"))
+
+
+def applied_versions(conn):
+    rows = conn.execute(text("SELECT version FROM schema_migrations")).fetchall()
+    return {row[0] for row in rows}
+
+
+def _lock_for_migration(conn):
+    # A transação do pysqlite só começaria no primeiro INSERT; abre já com a trava
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def run_migrations(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, description VARCHAR NOT NULL, applied_at VARCHAR NOT NULL)"
+        ))
+
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        with engine.begin() as conn:
+            _lock_for_migration(conn)
+            if version in applied_versions(conn):
+                continue
+            print(f"Aplicando migração {version}: {description}")
+            fn(conn)
+            conn.execute(
+                text(
+                    "INSERT OR IGNORE INTO schema_migrations (version, description, applied_at) "
+                    "VALUES (:version, :description, :applied_at)"
+                ),
+                {
+                    "version": version,
+                    "description": description,
+                    "applied_at": datetime.now(timezone.utc).isoformat(),
+                },
+            )
+            applied.append(version)
+    return applied
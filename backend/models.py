@@ -0,0 +1,72 @@
+# Modelos das tabelas do banco
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlmodel import Field, SQLModel
+
+
+class User(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    email: str
+    name: str
+    password_hash: str
+    role: str
+
+
+class Conversation(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    customer_number: str
+    name: Optional[str] = None
+    assigned_to: str | None
+    created_by: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    status: str = "pending"
+    # Versão da última alteração (ver backend/change_feed.py)
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+
+
+class Message(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    conversation_id: int
+    sender: str
+    content: str
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class InboundEvent(SQLModel, table=True):
+    # Evento bruto recebido pelo webhook do WhatsApp (ver backend/inbox.py)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    message_sid: str = Field(unique=True)
+    from_number: str
+    body: str
+    profile_name: Optional[str] = None
+    status: str = "pending"  # pending | processing | done | failed
+    attempts: int = 0
+    last_error: Optional[str] = None
+    owner: Optional[str] = None  # worker que está com o evento
+    lease_until: Optional[datetime] = None
+    # Progresso do processamento, para retentativas não repetirem etapas
+    conversation_id: Optional[int] = None
+    message_id: Optional[int] = None
+    replied_at: Optional[datetime] = None
+    received_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    processed_at: Optional[datetime] = None
+
+
+class ArchivedConversation(SQLModel, table=True):
+    # Onde estão as mensagens de uma conversa arquivada (ver backend/archive.py)
+    conversation_id: int = Field(primary_key=True)
+    segment: int
+    byte_offset: int
+    byte_length: int
+    message_count: int
+    last_message_id: int
+    archived_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Usuario(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    nome: str
+    email: str
+    senha: str
@@ -0,0 +1,204 @@
+# Pipeline de envio de mensagens WhatsApp
+#
+# Os handlers apenas enfileiram a mensagem; um pool de workers assíncronos
+# entrega via transporte (Twilio ou fake), com limite de taxa por worker,
+# retentativas com backoff exponencial + jitter e um registro de status
+# por mensagem.
+
+import asyncio
+import random
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+
+class TransportError(Exception):
+    pass
+
+
+class TwilioTransport:
+    """Envia pelo client síncrono do Twilio, fora do event loop."""
+
+    def __init__(self, client, from_number: Optional[str]):
+        self.client = client
+        self.from_number = from_number
+
+    async def send(self, to_number: str, body: str) -> str:
+        msg = await asyncio.to_thread(
+            self.client.messages.create,
+            body=body,
+            from_=self.from_number,
+            to=f"whatsapp:{to_number}",
+        )
+        return msg.sid
+
+
+class FakeTransport:
+    """Transporte local para desenvolvimento e benchmarks sem Twilio."""
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.sent = []
+
+    async def send(self, to_number: str, body: str) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise TransportError("falha simulada no transporte fake")
+        sid = f"SMfake{uuid.uuid4().hex[:26]}"
+        self.sent.append((sid, to_number, body))
+        return sid
+
+
+@dataclass
+class Delivery:
+    id: str
+    to_number: str
+    body: str
+    status: str = "queued"  # queued | sending | retrying | sent | failed
+    attempts: int = 0
+    sid: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def as_dict(self):
+        data = asdict(self)
+        data["created_at"] = self.created_at.isoformat()
+        data["updated_at"] = self.updated_at.isoformat()
+        return data
+
+
+class OutboundDispatcher:
+    def __init__(
+        self,
+        transport,
+        workers: int = 4,
+        rate_per_sender: float = 5.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 10.0,
+        queue_size: int = 1000,
+        history_size: int = 5000,
+        on_send: Optional[Callable[[float, bool], None]] = None,
+    ):
+        self.transport = transport
+        # Chamado após cada tentativa de envio com (segundos, sucesso)
+        self.on_send = on_send
+        self.workers = workers
+        self.min_interval = 1.0 / rate_per_sender if rate_per_sender > 0 else 0.0
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.history_size = history_size
+        self.deliveries: "OrderedDict[str, Delivery]" = OrderedDict()
+        self._tasks = []
+        self._retry_handles: Dict[asyncio.TimerHandle, Delivery] = {}
+        self.sent_count = 0
+        self.failed_count = 0
+        self.retry_count = 0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = 5.0):
+        # Tenta esvaziar a fila antes de encerrar os workers
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Encerrando envio com {self.queue.qsize()} mensagens na fila")
+        # Retentativas agendadas não vão mais rodar: contam como falha
+        for handle, delivery in self._retry_handles.items():
+            handle.cancel()
+            self.failed_count += 1
+            self._mark(delivery, "failed", error="encerrado")
+        self._retry_handles.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, to_number: str, body: str) -> Delivery:
+        delivery = Delivery(id=uuid.uuid4().hex, to_number=to_number, body=body)
+        self.deliveries[delivery.id] = delivery
+        while len(self.deliveries) > self.history_size:
+            self.deliveries.popitem(last=False)
+        await self.queue.put(delivery)
+        return delivery
+
+    def get(self, delivery_id: str) -> Optional[Delivery]:
+        return self.deliveries.get(delivery_id)
+
+    def stats(self):
+        return {
+            "workers": len(self._tasks),
+            "queue_depth": self.queue.qsize(),
+            "sent": self.sent_count,
+            "failed": self.failed_count,
+            "retries": self.retry_count,
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": espera aleatória até o teto exponencial
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return random.uniform(0, ceiling)
+
+    def _requeue(self, delivery: Delivery, handle_ref):
+        self._retry_handles.pop(handle_ref[0], None)
+        try:
+            self.queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            self._mark(delivery, "failed", error="fila cheia ao reenfileirar")
+            self.failed_count += 1
+
+    def _mark(self, delivery: Delivery, status: str, error: Optional[str] = None):
+        delivery.status = status
+        delivery.error = error
+        delivery.updated_at = datetime.now(timezone.utc)
+
+    async def _worker(self, index: int):
+        next_allowed = 0.0
+        while True:
+            delivery = await self.queue.get()
+            try:
+                wait = next_allowed - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                next_allowed = time.monotonic() + self.min_interval
+
+                delivery.attempts += 1
+                self._mark(delivery, "sending")
+                send_start = time.perf_counter()
+                try:
+                    delivery.sid = await self.transport.send(delivery.to_number, delivery.body)
+                except Exception as e:
+                    if self.on_send:
+                        self.on_send(time.perf_counter() - send_start, False)
+                    if delivery.attempts <= self.max_retries:
+                        self.retry_count += 1
+                        self._mark(delivery, "retrying", error=str(e))
+                        handle_ref = [None]
+                        handle_ref[0] = asyncio.get_running_loop().call_later(
+                            self._backoff(delivery.attempts), self._requeue, delivery, handle_ref
+                        )
+                        self._retry_handles[handle_ref[0]] = delivery
+                    else:
+                        self.failed_count += 1
+                        self._mark(delivery, "failed", error=str(e))
+                        print(f"Erro ao enviar mensagem via WhatsApp para {delivery.to_number}: {e}")
+                else:
+                    if self.on_send:
+                        self.on_send(time.perf_counter() - send_start, True)
+                    self.sent_count += 1
+                    self._mark(delivery, "sent")
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,132 @@
+# Profiler de consultas SQL
+#
+# Substitui o echo=True: em vez de imprimir tudo, agrega cada consulta pela
+# sua "impressão digital" (SQL normalizado, sem literais) com contagem,
+# tempo total e máximo, e guarda as consultas acima do limite com o plano
+# de execução (EXPLAIN QUERY PLAN no SQLite), capturado uma vez por
+# impressão digital. Desligado, o custo é só um teste de flag por consulta.
+
+import re
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import Optional
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+_EXPLAINABLE = ("select", "update", "delete", "insert", "with")
+
+
+def fingerprint(statement: str) -> str:
+    text = _STRING.sub("?", statement)
+    text = _NUMBER.sub("?", text)
+    text = _IN_LIST.sub("IN (?...)", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class QueryProfiler:
+    def __init__(
+        self,
+        enabled: bool = False,
+        slow_threshold: float = 0.1,
+        explain: bool = True,
+        max_statements: int = 500,
+        max_slow: int = 100,
+    ):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.max_statements = max_statements
+        # impressão digital -> {"count", "total", "max", "slow", "plan"}
+        self.statements: "OrderedDict[str, dict]" = OrderedDict()
+        self.slow = deque(maxlen=max_slow)
+        # SQL cru -> impressão digital (o SQLAlchemy repete as mesmas strings)
+        self.fingerprints = {}
+        self.since = datetime.now(timezone.utc)
+
+    def configure(self, enabled: Optional[bool] = None, slow_threshold: Optional[float] = None, explain: Optional[bool] = None):
+        if enabled is not None:
+            self.enabled = enabled
+        if slow_threshold is not None:
+            self.slow_threshold = slow_threshold
+        if explain is not None:
+            self.explain = explain
+
+    def reset(self):
+        self.statements.clear()
+        self.slow.clear()
+        self.since = datetime.now(timezone.utc)
+
+    def observe(self, conn, statement: str, parameters, seconds: float, executemany: bool = False):
+        key = self.fingerprints.get(statement)
+        if key is None:
+            if len(self.fingerprints) >= self.max_statements * 4:
+                self.fingerprints.clear()
+            key = self.fingerprints[statement] = fingerprint(statement)
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = self.statements[key] = {"count": 0, "total": 0.0, "max": 0.0, "slow": 0, "plan": None}
+            while len(self.statements) > self.max_statements:
+                self.statements.popitem(last=False)
+        entry["count"] += 1
+        entry["total"] += seconds
+        entry["max"] = max(entry["max"], seconds)
+        if seconds < self.slow_threshold:
+            return
+
+        entry["slow"] += 1
+        if self.explain and entry["plan"] is None and not executemany:
+            entry["plan"] = self._explain(conn, statement, parameters)
+        self.slow.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "duration_ms": round(seconds * 1000, 2),
+            "fingerprint": key,
+            "statement": statement,
+            "parameters": repr(parameters)[:300],
+        })
+
+    @staticmethod
+    def _explain(conn, statement: str, parameters):
+        if not statement.lstrip()[:6].lower().startswith(_EXPLAINABLE):
+            return None
+        prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+        # Cursor direto do driver: não passa pelos eventos do SQLAlchemy
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters or ())
+            rows = cursor.fetchall()
+        except Exception as e:
+            return [f"EXPLAIN falhou: {e}"]
+        finally:
+            cursor.close()
+        if conn.dialect.name == "sqlite":
+            # (id, parent, notused, detail)
+            return [row[-1] for row in rows]
+        return [" ".join(str(value) for value in row) for row in rows]
+
+    def report(self, limit: int = 50, order_by: str = "total"):
+        rows = [
+            {
+                "fingerprint": key,
+                "count": entry["count"],
+                "total_ms": round(entry["total"] * 1000, 2),
+                "avg_ms": round(entry["total"] / entry["count"] * 1000, 3),
+                "max_ms": round(entry["max"] * 1000, 2),
+                "slow": entry["slow"],
+                "plan": entry["plan"],
+            }
+            for key, entry in self.statements.items()
+        ]
+        sort_key = {"total": "total_ms", "max": "max_ms", "count": "count", "avg": "avg_ms"}.get(order_by, "total_ms")
+        rows.sort(key=lambda row: row[sort_key], reverse=True)
+        return {
+            "enabled": self.enabled,
+            "slow_threshold_ms": self.slow_threshold * 1000,
+            "explain": self.explain,
+            "since": self.since.isoformat(),
+            "statements": len(self.statements),
+            "top": rows[:limit],
+            "slow_queries": list(self.slow)[::-1],
+        }
+
@@ -0,0 +1,298 @@
+# Busca textual no histórico de mensagens (SQLite FTS5)
+#
+# message_fts indexa o conteúdo de cada mensagem junto com o nome e o número
+# do cliente da conversa. É uma tabela de conteúdo externo: o texto fica só
+# em message/conversation (lido pela view message_search_source), e o
+# índice é mantido por triggers a cada inserção, alteração ou remoção.
+#
+# Mensagens arquivadas (backend/archive.py) continuam no índice: o
+# arquivador registra os ids em message_search_archived antes de apagá-las,
+# e a trigger de remoção ignora esses ids. Como o texto não está mais no
+# banco quente, a busca não chama snippet() para elas; a rota completa
+# remetente, horário e trecho lendo o registro do arquivo. Se o nome ou o
+# número da conversa mudar depois, essas mensagens ficam com os antigos no
+# índice até o próximo --rebuild.
+#
+# Para bancos existentes o índice pode ser reconstruído offline (inclusive
+# as mensagens arquivadas, relidas dos segmentos):
+#     python -m backend.search --rebuild
+
+import argparse
+import html
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import DateTime, text
+
+FTS_TABLE = "message_fts"
+ARCHIVED_TABLE = "message_search_archived"
+
+SCHEMA = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {ARCHIVED_TABLE} (
+        id INTEGER PRIMARY KEY, conversation_id INTEGER NOT NULL
+    )
+    """,
+    """
+    CREATE VIEW IF NOT EXISTS message_search_source AS
+    SELECT m.id AS id, m.content AS content, c.name AS name, c.customer_number AS customer_number
+    FROM message m LEFT JOIN conversation c ON c.id = m.conversation_id
+    """,
+    # remove_diacritics: "informacao" encontra "informação"
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        content, name, customer_number,
+        content='message_search_source', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS message_fts_insert AFTER INSERT ON message BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, content, name, customer_number)
+        SELECT new.id, new.content, c.name, c.customer_number
+        FROM (SELECT 1) LEFT JOIN conversation c ON c.id = new.conversation_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS message_fts_delete AFTER DELETE ON message
+    WHEN NOT EXISTS (SELECT 1 FROM {ARCHIVED_TABLE} a WHERE a.id = old.id) BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, content, name, customer_number)
+        SELECT 'delete', old.id, old.content, c.name, c.customer_number
+        FROM (SELECT 1) LEFT JOIN conversation c ON c.id = old.conversation_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS message_fts_update AFTER UPDATE OF content, conversation_id ON message BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, content, name, customer_number)
+        SELECT 'delete', old.id, old.content, c.name, c.customer_number
+        FROM (SELECT 1) LEFT JOIN conversation c ON c.id = old.conversation_id;
+        INSERT INTO {FTS_TABLE} (rowid, content, name, customer_number)
+        SELECT new.id, new.content, c.name, c.customer_number
+        FROM (SELECT 1) LEFT JOIN conversation c ON c.id = new.conversation_id;
+    END
+    """,
+    # Nome/número da conversa mudou: reindexa as mensagens dela
+    f"""
+    CREATE TRIGGER IF NOT EXISTS conversation_fts_update AFTER UPDATE OF name, customer_number ON conversation
+    WHEN old.name IS NOT new.name OR old.customer_number IS NOT new.customer_number BEGIN
+        INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, content, name, customer_number)
+        SELECT 'delete', m.id, m.content, old.name, old.customer_number FROM message m WHERE m.conversation_id = old.id;
+        INSERT INTO {FTS_TABLE} (rowid, content, name, customer_number)
+        SELECT m.id, m.content, new.name, new.customer_number FROM message m WHERE m.conversation_id = new.id;
+    END
+    """,
+]
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+# O trecho vai para o painel como HTML: snippet() marca os termos com
+# caracteres de uso privado, o texto é escapado e só então eles viram <mark>
+MARK_OPEN = "\ue000"
+MARK_CLOSE = "\ue001"
+
+
+def search_index_exists(conn) -> bool:
+    row = conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first()
+    return row is not None
+
+
+def create_search_index(conn):
+    for statement in SCHEMA:
+        conn.execute(text(statement))
+
+
+def rebuild_search_index(conn, archived_messages=()):
+    # Relê todas as mensagens pela view e refaz o índice do zero; as
+    # arquivadas não estão na view e vêm de archived_messages
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+    for conversation, messages in archived_messages:
+        for message in messages:
+            conn.execute(
+                text(f"INSERT OR IGNORE INTO {ARCHIVED_TABLE} (id, conversation_id) VALUES (:id, :conversation_id)"),
+                {"id": message["id"], "conversation_id": conversation.id},
+            )
+            conn.execute(
+                text(
+                    f"INSERT INTO {FTS_TABLE} (rowid, content, name, customer_number) "
+                    "VALUES (:id, :content, :name, :customer_number)"
+                ),
+                {
+                    "id": message["id"],
+                    "content": message["content"],
+                    "name": conversation.name,
+                    "customer_number": conversation.customer_number,
+                },
+            )
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"))
+
+
+def keep_archived_in_index(session, conversation_id: int, last_message_id: int):
+    """Marca as mensagens que vão para o arquivo, para que continuem no índice."""
+    session.execute(
+        text(
+            f"INSERT OR IGNORE INTO {ARCHIVED_TABLE} (id, conversation_id) "
+            "SELECT id, conversation_id FROM message WHERE conversation_id = :conversation_id AND id <= :last_id"
+        ),
+        {"conversation_id": conversation_id, "last_id": last_message_id},
+    )
+
+
+def build_match_query(query: str) -> str:
+    """Converte o texto digitado numa expressão FTS5 segura.
+
+    Cada palavra vira um termo entre aspas (sem operadores do FTS5) e a
+    última é buscada como prefixo, para achar enquanto se digita.
+    """
+    tokens = _TOKEN.findall(query)
+    if not tokens:
+        return ""
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+# snippet() lê o texto pela view: só para mensagens que ainda estão nela
+SEARCH_SQL = f"""
+    SELECT {FTS_TABLE}.rowid AS id, c.id AS conversation_id, m.sender, m.timestamp,
+           CASE WHEN m.id IS NOT NULL
+                THEN snippet({FTS_TABLE}, 0, :mark_open, :mark_close, '…', 12) END AS snippet,
+           c.name, c.customer_number, c.status, bm25({FTS_TABLE}, 1.0, 2.0, 2.0) AS score,
+           m.id IS NULL AS archived
+    FROM {FTS_TABLE}
+    LEFT JOIN message m ON m.id = {FTS_TABLE}.rowid
+    LEFT JOIN {ARCHIVED_TABLE} a ON a.id = {FTS_TABLE}.rowid
+    JOIN conversation c ON c.id = COALESCE(m.conversation_id, a.conversation_id)
+    WHERE {FTS_TABLE} MATCH :match {{scope}}
+    ORDER BY score, {FTS_TABLE}.rowid DESC
+    LIMIT :limit OFFSET :offset
+"""
+
+
+def highlight(snippet):
+    """Escapa o trecho e troca os marcadores do snippet() por <mark>."""
+    if snippet is None:
+        return None
+    # Marcadores vindos do próprio texto geram no máximo um <mark> a mais,
+    # sempre fechado
+    parts = snippet.split(MARK_OPEN)
+    escaped = html.escape(parts[0].replace(MARK_CLOSE, ""))
+    for part in parts[1:]:
+        term, _, rest = part.partition(MARK_CLOSE)
+        escaped += f"<mark>{html.escape(term)}</mark>{html.escape(rest.replace(MARK_CLOSE, ''))}"
+    return escaped
+
+
+async def search_messages(session, match: str, user_id=None, limit: int = 20, offset: int = 0):
+    """Mensagens que casam com a expressão, da mais relevante para a menos.
+
+    Com user_id, só conversas atribuídas a ele ou criadas por ele (a mesma
+    regra de acesso de get_messages); sem, todas (admins). Resultados com
+    archived=True vêm sem remetente, horário e trecho: ver fill_archived_results.
+    """
+    params = {
+        "match": match, "limit": limit + 1, "offset": offset,
+        "mark_open": MARK_OPEN, "mark_close": MARK_CLOSE,
+    }
+    scope = ""
+    if user_id is not None:
+        # assigned_to/created_by são gravados como texto no banco
+        scope = "AND (c.assigned_to = :user_id OR c.created_by = :user_id)"
+        params["user_id"] = str(user_id)
+    # timestamp tipado para voltar como datetime, igual ao de get_messages
+    query = text(SEARCH_SQL.format(scope=scope)).columns(timestamp=DateTime)
+    rows = (await session.execute(query, params)).mappings().all()
+    results = [
+        {
+            "message_id": row["id"],
+            "conversation_id": row["conversation_id"],
+            "sender": row["sender"],
+            "timestamp": row["timestamp"],
+            "snippet": highlight(row["snippet"]),
+            "name": row["name"],
+            "customer_number": row["customer_number"],
+            "status": row["status"],
+            "score": round(-row["score"], 4),
+            "archived": bool(row["archived"]),
+        }
+        for row in rows[:limit]
+    ]
+    return results, len(rows) > limit
+
+
+def archived_snippet(content: str, query: str, size: int = 12) -> str:
+    """Trecho em volta da primeira palavra buscada, no formato do snippet() do FTS5.
+
+    Aproximação para mensagens arquivadas: compara sem diferenciar
+    maiúsculas, mas com acentos (o índice ignora acentos).
+    """
+    tokens = _TOKEN.findall(query.lower())
+    words = content.split()
+    if not tokens or not words:
+        return html.escape(content)
+
+    def matches(word: str):
+        word = "".join(_TOKEN.findall(word.lower()))
+        return word in tokens or word.startswith(tokens[-1])
+
+    first = next((i for i, word in enumerate(words) if matches(word)), 0)
+    start = max(0, min(first - size // 4, len(words) - size))
+    window = [
+        f"<mark>{html.escape(word)}</mark>" if matches(word) else html.escape(word)
+        for word in words[start:start + size]
+    ]
+    return ("…" if start > 0 else "") + " ".join(window) + ("…" if start + size < len(words) else "")
+
+
+async def fill_archived_results(session, results, load_messages, query: str):
+    """Completa os resultados arquivados com o registro da conversa no arquivo."""
+    archived = {}
+    for result in results:
+        if not result["archived"]:
+            continue
+        conversation_id = result["conversation_id"]
+        if conversation_id not in archived:
+            messages = await load_messages(session, conversation_id) or []
+            archived[conversation_id] = {message["id"]: message for message in messages}
+        message = archived[conversation_id].get(result["message_id"])
+        if message is None:
+            continue
+        result["sender"] = message["sender"]
+        result["timestamp"] = datetime.fromisoformat(message["timestamp"])
+        result["snippet"] = archived_snippet(message["content"], query)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de busca das mensagens (FTS5)")
+    parser.add_argument("--rebuild", action="store_true", help="recria o índice a partir das mensagens existentes")
+    args = parser.parse_args()
+
+    from sqlmodel import Session, select
+
+    from backend.archive import ConversationArchive
+    from backend.database import engine
+    from backend.models import ArchivedConversation, Conversation
+
+    if not args.rebuild:
+        parser.print_help()
+        return
+    archive = ConversationArchive(engine, os.getenv("ARCHIVE_DIR", "./archive"), cache_size=0)
+    with Session(engine) as session:
+        entries = session.exec(
+            select(ArchivedConversation, Conversation)
+            .join(Conversation, Conversation.id == ArchivedConversation.conversation_id)
+        ).all()
+    # Um registro por vez, para não carregar o arquivo inteiro na memória
+    archived = ((conversation, archive.read_record(entry)) for entry, conversation in entries)
+    with engine.begin() as conn:
+        create_search_index(conn)
+        rebuild_search_index(conn, archived)
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE}_docsize")).scalar_one()
+    print(f"Índice de busca reconstruído: {total} mensagens")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Escrita em lote (group commit)
+#
+# No SQLite cada commit tem custo fixo (lock de escrita, WAL, fsync), então
+# as inserções de Message e Conversation passam por aqui: as operações que
+# chegam dentro de alguns milissegundos rodam em ordem numa única transação
+# e cada chamador recebe o resultado da sua. Se o lote falhar, cada operação
+# é refeita sozinha, para que o erro chegue só a quem o causou; por isso uma
+# operação precisa poder rodar de novo (criar seus objetos dentro dela).
+#
+# As consultas de cada operação contam para a requisição que a pediu
+# (backend/metrics.py); as do commit do lote, que todas esperaram, contam
+# para cada uma delas.
+
+import asyncio
+import statistics
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from backend.metrics import record_queries_into, request_queries
+
+Operation = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class GroupCommitWriter:
+    def __init__(self, session_maker, max_batch: int = 500, max_delay: float = 0.002, history_size: int = 1000):
+        self.session_maker = session_maker
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = deque()  # (operação, future, consultas de quem pediu)
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.stopping = False
+        self.batches = 0
+        self.operations = 0
+        self.fallbacks = 0
+        self.batch_sizes = deque(maxlen=history_size)
+        self.commit_times = deque(maxlen=history_size)
+
+    def start(self):
+        if self.task is None:
+            self.stopping = False
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        # O loop termina o que já foi enfileirado antes de sair
+        self.stopping = True
+        self.wakeup.set()
+        await self.task
+        self.task = None
+
+    async def run(self, operation: Operation):
+        """Executa operation(session) no próximo lote e espera o commit."""
+        if self.task is None:
+            # Sem o writer rodando (scripts, testes): transação própria
+            async with self.session_maker() as session:
+                result = await operation(session)
+                await session.commit()
+                return result
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((operation, future, request_queries()))
+        self.wakeup.set()
+        return await future
+
+    async def add(self, *objects):
+        """Insere os objetos; ao retornar eles já têm id."""
+        initial_ids = [obj.id for obj in objects]
+
+        async def operation(session):
+            for obj, initial_id in zip(objects, initial_ids):
+                if inspect(obj).detached:
+                    # Sobrou de um lote que falhou: volta a ser um INSERT novo
+                    make_transient(obj)
+                    obj.id = initial_id
+            session.add_all(objects)
+        await self.run(operation)
+        return objects[0] if len(objects) == 1 else objects
+
+    async def _run(self):
+        while True:
+            if not self.pending:
+                if self.stopping:
+                    return
+                self.wakeup.clear()
+                await self.wakeup.wait()
+            if not self.pending:
+                continue
+            if self.max_delay and len(self.pending) < self.max_batch and not self.stopping:
+                # Janela curta para juntar mais operações no mesmo commit
+                await asyncio.sleep(self.max_delay)
+            try:
+                await self._flush()
+            except Exception as e:
+                print(f"Erro no writer em lote: {e}")
+
+    async def _flush(self):
+        batch = [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+        batch = [entry for entry in batch if not entry[1].cancelled()]
+        if not batch:
+            return
+        start = time.perf_counter()
+        results = []
+        shared = []
+        try:
+            async with self.session_maker() as session:
+                for operation, _, queries in batch:
+                    with record_queries_into(queries):
+                        results.append(await operation(session))
+                with record_queries_into(shared):
+                    await session.commit()
+        except Exception:
+            self.fallbacks += 1
+            await self._run_individually(batch)
+            return
+        finally:
+            for _, _, queries in batch:
+                if queries is not None:
+                    queries.extend(shared)
+            self.batches += 1
+            self.operations += len(batch)
+            self.batch_sizes.append(len(batch))
+            self.commit_times.append(time.perf_counter() - start)
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run_individually(self, batch):
+        for operation, future, queries in batch:
+            try:
+                with record_queries_into(queries):
+                    async with self.session_maker() as session:
+                        result = await operation(session)
+                        await session.commit()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def stats(self):
+        sizes = list(self.batch_sizes)
+        commits = sorted(self.commit_times)
+        return {
+            "batches": self.batches,
+            "operations": self.operations,
+            "fallbacks": self.fallbacks,
+            "queued": len(self.pending),
+            "avg_batch_size": round(statistics.mean(sizes), 2) if sizes else None,
+            "max_batch_size": max(sizes) if sizes else None,
+            "commit_ms": {
+                "p50": round(statistics.median(commits) * 1000, 2) if commits else None,
+                "max": round(commits[-1] * 1000, 2) if commits else None,
+            },
+        }